@@ -0,0 +1,36 @@
+"""notes trigram indexes
+
+Revision ID: 3f9b2c6d1e47
+Revises: d148e821df17
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9b2c6d1e47'
+down_revision: str | Sequence[str] | None = 'd148e821df17'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    op.create_index(
+        'ix_notes_name_trgm', 'notes', ['name'], postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_notes_text_trgm', 'notes', ['text'], postgresql_using='gin', postgresql_ops={'text': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notes_text_trgm', table_name='notes')
+    op.drop_index('ix_notes_name_trgm', table_name='notes')
+    # the extension is left installed, other objects of the database may depend on it
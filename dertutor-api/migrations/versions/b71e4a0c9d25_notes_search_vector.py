@@ -0,0 +1,85 @@
+"""notes search vector
+
+Revision ID: b71e4a0c9d25
+Revises: 3f9b2c6d1e47
+Create Date: 2026-10-18 11:37:05.918342
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71e4a0c9d25'
+down_revision: str | Sequence[str] | None = '3f9b2c6d1e47'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        sa.text("""
+        CREATE FUNCTION lang_ts_config(code text) RETURNS regconfig
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE code
+                WHEN 'de' THEN 'german'
+                WHEN 'en' THEN 'english'
+                WHEN 'ru' THEN 'russian'
+                ELSE 'simple'
+            END::regconfig
+        $$
+        """)
+    )
+
+    # a generated column can not read langs, so the config of a note is stored by a trigger
+    op.add_column(
+        'notes', sa.Column('ts_config', postgresql.REGCONFIG(), nullable=False, server_default=sa.text("'simple'"))
+    )
+    op.execute(
+        sa.text("""
+        CREATE FUNCTION notes_set_ts_config() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.ts_config := lang_ts_config((SELECT code FROM langs WHERE id = NEW.lang_id));
+            RETURN NEW;
+        END
+        $$
+        """)
+    )
+    op.execute(
+        sa.text("""
+        CREATE TRIGGER notes_set_ts_config BEFORE INSERT OR UPDATE OF lang_id ON notes
+        FOR EACH ROW EXECUTE FUNCTION notes_set_ts_config()
+        """)
+    )
+    op.execute(
+        sa.text('UPDATE notes SET ts_config = lang_ts_config(langs.code) FROM langs WHERE langs.id = notes.lang_id')
+    )
+
+    op.add_column(
+        'notes',
+        sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "setweight(to_tsvector(ts_config, name), 'A') || setweight(to_tsvector(ts_config, text), 'B')",
+                persisted=True,
+            ),
+            nullable=False,
+        ),
+    )
+    op.create_index('ix_notes_search_vector', 'notes', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notes_search_vector', table_name='notes')
+    op.drop_column('notes', 'search_vector')
+    op.execute(sa.text('DROP TRIGGER notes_set_ts_config ON notes'))
+    op.execute(sa.text('DROP FUNCTION notes_set_ts_config()'))
+    op.drop_column('notes', 'ts_config')
+    op.execute(sa.text('DROP FUNCTION lang_ts_config(text)'))
@@ -0,0 +1,27 @@
+"""notes voc_id id index
+
+Revision ID: e5a1d7c3b829
+Revises: b71e4a0c9d25
+Create Date: 2026-10-18 14:05:52.731604
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a1d7c3b829'
+down_revision: str | Sequence[str] | None = 'b71e4a0c9d25'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_notes_voc_id_id', 'notes', ['voc_id', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notes_voc_id_id', table_name='notes')
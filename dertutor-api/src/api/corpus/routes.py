@@ -1,79 +1,285 @@
+import asyncio
 import logging
+import re
+from typing import Annotated, Literal
 from urllib.parse import unquote
 
 import src.context as ctx
-from fastapi import APIRouter, Response, status
+from fastapi import APIRouter, Query, Request, Response, status
 from fastapi.exceptions import HTTPException
-from src.api.corpus.schema import EnRuResponse
+from src.api.corpus.schema import (
+    CacheStatsRead,
+    CompactionRead,
+    CorpusKeys,
+    EnRuBatchResponse,
+    EnRuResponse,
+    ExistsResponse,
+    LemmaBatch,
+    LemmaBatchResponse,
+    LemmaToken,
+    LemmatizerStatsRead,
+    SuggestParams,
+    SuggestResponse,
+    TextSearchParams,
+    TextSearchResponse,
+)
+from src.api.decorators import only_superuser, open_session
+from src.core.database import InvalidDBOperationError, JsonFileDB, KeyValueDB, SegmentedKeyValueDB
+from src.core.lemmatizer import LemmatizerBusyError, tokenize_sentences
 
 router = APIRouter(prefix='', tags=['Corpus'])
 log = logging.getLogger('uvicorn')
 
+# the urls are addressed by key, not by content: a key may be resolved to another record (normalized form, lemma),
+# a record may be replaced and compaction changes the etags, so clients revalidate their copy with the etag
+AUDIO_CACHE_CONTROL = 'public, no-cache'
+# the dictionary can be replaced, clients revalidate their copy with the etag
+TRANSLATION_CACHE_CONTROL = 'public, no-cache'
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Returns first and last byte of a single range, e.g. bytes=0-1023, bytes=1024-, bytes=-512.
+    Raises ValueError if the range can not be satisfied, returns None if the header is ignored."""
+    m = RANGE_PATTERN.fullmatch(range_header.strip())
+    if not m or (not m[1] and not m[2]):
+        # multiple ranges and unknown units are not supported, the whole value is sent
+        return None
+
+    if not m[1]:
+        suffix_len = int(m[2])
+        if suffix_len == 0:
+            raise ValueError(range_header)
+        return max(size - suffix_len, 0), size - 1
+
+    first = int(m[1])
+    if m[2] and int(m[2]) < first:
+        # invalid range
+        return None
+    if first >= size:
+        raise ValueError(range_header)
+    return first, min(int(m[2]), size - 1) if m[2] else size - 1
+
+
+async def resolve_key(
+    db: KeyValueDB | SegmentedKeyValueDB | JsonFileDB, key: str, use_lemma: bool = False
+) -> str | None:
+    """Looks up the key as is, then its normalized form (Strasse -> Straße), then the german lemma (Häuser -> Haus)"""
+    found_key = db.find(key)
+    if found_key is None and use_lemma:
+        try:
+            res = await ctx.de_lemmatizer.analyze_async(key)
+        except LemmatizerBusyError as e:
+            # the lemma is only a fallback, the key is reported as not found
+            log.warning('%s', e)
+            return None
+        if res and res[0] and res[0] != key:
+            found_key = db.find(res[0])
+    return found_key
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+
+
+async def audio_response(
+    db: KeyValueDB | SegmentedKeyValueDB, key: str, request: Request, use_lemma: bool = False
+) -> Response:
+    decoded_key = unquote(key)
+    found_key = await resolve_key(db, decoded_key, use_lemma)
+    etag = db.etag(found_key) if found_key else None
+    if not found_key or not etag:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Audio <{decoded_key}> not found')
+
+    headers = {'ETag': etag, 'Cache-Control': AUDIO_CACHE_CONTROL, 'Accept-Ranges': 'bytes'}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    bb = await db.read_async(found_key)
+    if bb is None:
+        # removed after the etag was taken
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Audio <{decoded_key}> not found')
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, len(bb))
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{len(bb)}'
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+        if byte_range:
+            first, last = byte_range
+            headers['Content-Range'] = f'bytes {first}-{last}/{len(bb)}'
+            return Response(
+                content=bb[first : last + 1],
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type='audio/mpeg',
+                headers=headers,
+            )
+
+    # bb is a memoryview of the mapped db-file in mmap mode, Response sends it without copying
+    return Response(content=bb, media_type='audio/mpeg', headers=headers)
+
 
 @router.head('/corpus/de_pron/search')
 async def check_de_audio_file(key: str):
     decoded_key = unquote(key)
-    if ctx.de_pron_db.has(decoded_key):
+    if await resolve_key(ctx.de_pron_db, decoded_key, use_lemma=True):
         return Response(status_code=status.HTTP_200_OK)
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Audio <{decoded_key}> not found')
 
 
 @router.get('/corpus/de_pron/search')
-async def get_de_audio_file(key: str):
-    decoded_key = unquote(key)
-    bb = ctx.de_pron_db.read(decoded_key)
-    if bb:
-        return Response(content=bb, media_type='audio/mpeg')
-    else:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Audio <{decoded_key}> not found')
+async def get_de_audio_file(key: str, request: Request):
+    return await audio_response(ctx.de_pron_db, key, request, use_lemma=True)
+
+
+@router.post('/corpus/de_pron/exists', response_model=ExistsResponse)
+async def check_de_audio_files(data: CorpusKeys):
+    return {'exists': [await resolve_key(ctx.de_pron_db, k, use_lemma=True) is not None for k in data.keys]}
 
 
 @router.head('/corpus/en_pron/search')
 async def check_en_audio_file(key: str):
     decoded_key = unquote(key)
-    if ctx.en_pron_db.has(decoded_key):
+    if await resolve_key(ctx.en_pron_db, decoded_key):
         return Response(status_code=status.HTTP_200_OK)
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Audio <{decoded_key}> not found')
 
 
 @router.get('/corpus/en_pron/search')
-async def get_en_audio_file(key: str):
-    decoded_key = unquote(key)
-    bb = ctx.en_pron_db.read(decoded_key)
-    if bb:
-        return Response(content=bb, media_type='audio/mpeg')
-    else:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Audio <{decoded_key}> not found')
+async def get_en_audio_file(key: str, request: Request):
+    return await audio_response(ctx.en_pron_db, key, request)
+
+
+@router.post('/corpus/en_pron/exists', response_model=ExistsResponse)
+async def check_en_audio_files(data: CorpusKeys):
+    return {'exists': [await resolve_key(ctx.en_pron_db, k) is not None for k in data.keys]}
+
+
+@router.post('/corpus/{db_name}/compact', response_model=CompactionRead)
+@open_session
+@only_superuser
+async def compact_pron_db(db_name: Literal['de_pron', 'en_pron']):
+    db = ctx.de_pron_db if db_name == 'de_pron' else ctx.en_pron_db
+    # copying runs in a worker thread, the db keeps serving requests until the compacted file is swapped in
+    try:
+        return await asyncio.to_thread(db.compact)
+    except InvalidDBOperationError as e:
+        # a compaction started by another request is still running
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=e.details)
+
+
+@router.get('/corpus/{db_name}/cache', response_model=CacheStatsRead)
+@open_session
+@only_superuser
+async def get_pron_db_cache_stats(db_name: Literal['de_pron', 'en_pron']):
+    db = ctx.de_pron_db if db_name == 'de_pron' else ctx.en_pron_db
+    if not db.cache:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Cache of <{db_name}> is disabled')
+    return db.cache.stats()
 
 
 @router.head('/corpus/en_ru/search')
 async def check_translation(key: str):
     decoded_key = unquote(key)
-    if ctx.en_ru_db.has(decoded_key):
+    if await resolve_key(ctx.en_ru_db, decoded_key):
         return Response(status_code=status.HTTP_200_OK)
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Translation of <{decoded_key}> not found')
 
 
 @router.get('/corpus/en_ru/search', response_model=EnRuResponse)
-async def get_translation(key: str):
+async def get_translation(key: str, request: Request):
     decoded_key = unquote(key)
-    item = ctx.en_ru_db.read(decoded_key)
-    if item:
-        return item
-    else:
+    found_key = await resolve_key(ctx.en_ru_db, decoded_key)
+    etag = ctx.en_ru_db.etag(found_key) if found_key else None
+    if not found_key or not etag:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Translation of <{decoded_key}> not found')
+
+    headers = {'ETag': etag, 'Cache-Control': TRANSLATION_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    bb = ctx.en_ru_db.read_raw(found_key)
+    if bb is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Translation of <{decoded_key}> not found')
+    # the item is stored as serialized json, it is sent as is without validation and serialization
+    return Response(content=bb, media_type='application/json', headers=headers)
+
+
+@router.get('/corpus/en_ru/suggest', response_model=SuggestResponse)
+async def suggest_translation_keys(params: Annotated[SuggestParams, Query()]):
+    return {'keys': ctx.en_ru_db.keys_with_prefix(unquote(params.prefix), params.limit)}
+
+
+@router.get('/corpus/en_ru/text_search', response_model=TextSearchResponse)
+async def search_translations_by_text(params: Annotated[TextSearchParams, Query()]):
+    if ctx.en_ru_db.text_index is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Full-text search of en_ru is disabled')
+
+    # scoring walks the postings of every query token, it is done in a worker thread
+    res = await asyncio.to_thread(ctx.en_ru_db.search_text, unquote(params.query), params.limit)
+    if res is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Full-text index of en_ru is being built'
+        )
+    return {'items': [{'key': key, 'score': score} for key, score in res]}
+
+
+@router.post('/corpus/en_ru/batch', response_model=EnRuBatchResponse)
+async def get_translations(data: CorpusKeys):
+    found_keys = [await resolve_key(ctx.en_ru_db, k) for k in data.keys]
+    items = [ctx.en_ru_db.read_raw(k) if k else None for k in found_keys]
+    content = b'{"items":[' + b','.join(bb if bb is not None else b'null' for bb in items) + b']}'
+    return Response(content=content, media_type='application/json')
 
 
 @router.get('/corpus/de_lemma')
 async def get_de_lemma(word: str):
     decoded_word = unquote(word)
-    res = ctx.de_tagger.analyze(decoded_word)
+    try:
+        res = await ctx.de_lemmatizer.analyze_async(decoded_word)
+    except LemmatizerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=e.details)
     if res and res[0]:
         return res[0]
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f'Taking lemma of <{decoded_word}> has failed'
         )
+
+
+@router.post('/corpus/de_lemma/batch', response_model=LemmaBatchResponse)
+async def get_de_lemmas(data: LemmaBatch):
+    """The tokens of a text are tagged in the context of their sentences, repeated sentences are tagged once.
+    Separate tokens are analyzed without context, repeated tokens are analyzed once."""
+    try:
+        if data.text is not None:
+            sentences = await ctx.de_lemmatizer.tag_sentences_async(tokenize_sentences(data.text))
+            tokens = [LemmaToken(token=t, lemma=lemma, pos=pos) for s in sentences for t, lemma, pos in s]
+        elif data.tokens is not None:
+            analysis = await ctx.de_lemmatizer.analyze_many_async(data.tokens)
+            tokens = [LemmaToken(token=t, lemma=analysis[t][0], pos=analysis[t][1]) for t in data.tokens]
+        else:
+            # excluded by the validation of LemmaBatch
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Either text or tokens must be given'
+            )
+    except LemmatizerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=e.details)
+    return LemmaBatchResponse(tokens=tokens)
+
+
+@router.get('/corpus/de_lemma/stats', response_model=LemmatizerStatsRead)
+@open_session
+@only_superuser
+async def get_de_lemma_stats():
+    return ctx.de_lemmatizer.stats()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 
 
 class EnRuExample(BaseModel):
@@ -10,3 +10,90 @@ class EnRuResponse(BaseModel):
     key: str
     description: str
     examples: list[EnRuExample]
+
+
+class CorpusKeys(BaseModel):
+    keys: list[str] = Field(max_length=1000, description='Keys to look up (up to 1000)')
+
+
+class ExistsResponse(BaseModel):
+    exists: list[bool]
+
+
+class EnRuBatchResponse(BaseModel):
+    items: list[EnRuResponse | None]
+
+
+class SuggestParams(BaseModel):
+    prefix: str = Field(min_length=1, description='Beginning of the key')
+    limit: int = Field(10, gt=0, le=100, description='Limit of keys to return (1-100)')
+
+
+class SuggestResponse(BaseModel):
+    keys: list[str]
+
+
+class TextSearchParams(BaseModel):
+    query: str = Field(min_length=2, description='Words of a description or an example')
+    limit: int = Field(20, gt=0, le=100, description='Limit of keys to return (1-100)')
+
+
+class TextSearchItem(BaseModel):
+    key: str
+    score: float
+
+
+class TextSearchResponse(BaseModel):
+    items: list[TextSearchItem]
+
+
+class LemmaBatch(BaseModel):
+    text: str | None = Field(None, max_length=20_000, description='Text, tagged sentence by sentence')
+    tokens: list[str] | None = Field(None, max_length=1000, description='Words analyzed without context (up to 1000)')
+
+    @model_validator(mode='after')
+    def check_input(self):
+        if (self.text is None) == (self.tokens is None):
+            raise ValueError('Either text or tokens must be given')
+        return self
+
+
+class LemmaToken(BaseModel):
+    token: str
+    lemma: str
+    pos: str
+
+
+class LemmaBatchResponse(BaseModel):
+    tokens: list[LemmaToken]
+
+
+class LemmatizerStatsRead(BaseModel):
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+    workers: int
+    pending: int
+    rejected: int
+
+
+class CompactionRead(BaseModel):
+    db_path: str
+    size_before: int
+    size_after: int
+    reclaimed_bytes: int
+    keys: int
+    duration_sec: float
+
+
+class CacheStatsRead(BaseModel):
+    max_size: int
+    size: int
+    items: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
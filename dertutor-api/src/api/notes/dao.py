@@ -1,7 +1,11 @@
+import base64
+import binascii
 import math
-from typing import Any
+from typing import Any, Literal
 
+import orjson
 import sqlalchemy
+from fastapi import HTTPException, status
 from pydantic.fields import Field
 from pydantic.main import BaseModel
 from sqlalchemy.ext.asyncio.session import AsyncSession
@@ -11,6 +15,32 @@ from src.api.notes.schema import Page
 from src.repo import Note
 
 
+NOTE_COLUMNS = 'id, lang_id, voc_id, name, text, audio_url, level, tag_id'
+
+# the config is taken from the lang of the search, not from the row, so the query is a constant
+# and search_vector @@ query can be answered by the GIN index ix_notes_search_vector
+TS_QUERY = '(SELECT websearch_to_tsquery(lang_ts_config(code), :key) FROM langs WHERE id = :lang_id)'
+TS_HEADLINE_OPTIONS = 'MaxFragments=2, MaxWords=15, MinWords=5'
+
+# columns a voc can sort its notes by: the type of their values and whether they are nullable
+SORT_COLUMNS: dict[str, tuple[type, bool]] = {
+    'id': (int, False),
+    'name': (str, False),
+    'text': (str, False),
+    'lang_id': (int, False),
+    'voc_id': (int, False),
+    'audio_url': (str, False),
+    'level': (int, True),
+    'tag_id': (int, True),
+}
+
+# the values of the text are not limited in size, they are not put into a cursor
+CURSOR_EXCLUDED_COLUMNS = ('text',)
+
+# (expression, asc | desc, placement of NULLs: first | last, None if the expression is never NULL, type of its values)
+OrderTerm = tuple[str, str, str | None, type]
+
+
 class SearchParams(BaseModel):
     lang_id: int
     size: int = Field(50, gt=0, le=100, description='Limit of items to return (1-100)')
@@ -20,6 +50,18 @@ class SearchParams(BaseModel):
     level: int | None = Field(None, ge=1)
     tag_id: int | None = Field(None, ge=1)
     sort: str | None = Field(None, min_length=2, description='Sort notes, e.g. name:asc')
+    mode: Literal['substring', 'fulltext'] = Field(
+        'substring', description='Search the key as a substring or as words in any inflection, ranked by relevance'
+    )
+    pagination: Literal['offset', 'cursor'] = Field(
+        'offset', description='Skip size * (page - 1) notes or continue after the cursor, that is fast on any depth'
+    )
+    cursor: str | None = Field(None, description='next_cursor of the previous page, the first page has no cursor')
+    total: Literal['exact', 'window', 'estimated'] = Field(
+        'exact',
+        description='Count the notes by a second query, by COUNT(*) OVER() in the page query, that reads all found '
+        'notes before LIMIT, or take the estimate of the planner, that is only done without a key',
+    )
 
 
 class SearchByNameParams(BaseModel):
@@ -28,6 +70,103 @@ class SearchByNameParams(BaseModel):
     voc_id: int | None = Field(None, ge=1)
 
 
+def escape_like(key: str) -> str:
+    """Matches % and _ of the key literally, backslash is the default escape character of LIKE"""
+    return key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_sort(sort: str | None) -> list[OrderTerm]:
+    """'name:asc, level desc nulls first' -> [('name', 'asc', None, str), ('level', 'desc', 'first', int)],
+    default is id:desc. vocs.sort_notes is stored as 'name asc' or 'name:asc', both are accepted"""
+    terms: list[OrderTerm] = []
+    for term in (sort or 'id:desc').split(','):
+        column, *words = term.replace(':', ' ').lower().split() or ['']
+        direction = words.pop(0) if words and words[0] in ('asc', 'desc') else 'asc'
+        nulls = None
+        if len(words) == 2 and words[0] == 'nulls' and words[1] in ('first', 'last'):
+            nulls = words.pop()
+            words.clear()
+        if column not in SORT_COLUMNS or words:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Invalid sort <{sort}>')
+        value_type, nullable = SORT_COLUMNS[column]
+        if nullable:
+            # NULLs are placed as Postgres does by default: last in ascending order, first in descending
+            nulls = nulls or ('last' if direction == 'asc' else 'first')
+        terms.append((column, direction, nulls if nullable else None, value_type))
+    return terms
+
+
+def encode_cursor(sort_id: str, values: list[Any]) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps({'sort': sort_id, 'values': values})).decode()
+
+
+def decode_cursor(cursor: str, sort_id: str, order_terms: list[OrderTerm]) -> list[Any]:
+    """Values of the sort key of the last note of the previous page.
+    A cursor comes from the client, its values are checked against the terms before they get into the query."""
+    try:
+        data = orjson.loads(base64.urlsafe_b64decode(cursor))
+        values = data['values']
+        valid = (
+            data['sort'] == sort_id
+            and isinstance(values, list)
+            and len(values) == len(order_terms)
+            and all(is_cursor_value(value, term) for value, term in zip(values, order_terms))
+        )
+    except (binascii.Error, orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return values
+
+
+def is_cursor_value(value: Any, term: OrderTerm) -> bool:
+    _, _, nulls, value_type = term
+    if value is None:
+        return nulls is not None
+    if isinstance(value, bool):
+        return False
+    # a float rank may be encoded as an integral number
+    return isinstance(value, (int, float) if value_type is float else value_type)
+
+
+def seek_predicate(order_terms: list[OrderTerm], cursor_values: list[Any]) -> str:
+    """Notes after the cursor :c0, :c1, ... in the order of the terms, a NULL of the cursor has no parameter.
+    A row comparison is answered by a range scan of a matching index, it works only if all directions are equal
+    and no term is nullable. Otherwise the expanded OR is bounded by the first term, so an index on it still
+    limits the scan."""
+    directions = {d for _, d, _, _ in order_terms}
+    if len(directions) == 1 and all(nulls is None for _, _, nulls, _ in order_terms):
+        op = '>' if 'asc' in directions else '<'
+        exprs = ', '.join(expr for expr, _, _, _ in order_terms)
+        cursor = ', '.join(f':c{i}' for i in range(len(order_terms)))
+        return f'({exprs}) {op} ({cursor})'
+
+    def after(i: int) -> str:
+        expr, direction, nulls, _ = order_terms[i]
+        op = '>' if direction == 'asc' else '<'
+        if nulls is None:
+            return f'{expr} {op} :c{i}'
+        if cursor_values[i] is None:
+            return 'FALSE' if nulls == 'last' else f'{expr} IS NOT NULL'
+        return f'({expr} {op} :c{i} OR {expr} IS NULL)' if nulls == 'last' else f'{expr} {op} :c{i}'
+
+    def equal(j: int) -> str:
+        expr = order_terms[j][0]
+        return f'{expr} IS NULL' if cursor_values[j] is None else f'{expr} = :c{j}'
+
+    alternatives = [' AND '.join([*(equal(j) for j in range(i)), after(i)]) for i in range(len(order_terms))]
+    first_expr, first_direction, first_nulls, _ = order_terms[0]
+    alternatives_sql = ' OR '.join(f'({a})' for a in alternatives)
+    if first_nulls is not None:
+        return f'({alternatives_sql})'
+    return f'{first_expr} {">=" if first_direction == "asc" else "<="} :c0 AND ({alternatives_sql})'
+
+
+def order_by(term: OrderTerm) -> str:
+    expr, direction, nulls, _ = term
+    return f'{expr} {direction} NULLS {nulls}' if nulls else f'{expr} {direction}'
+
+
 class NotesDAO(BaseDAO[Note]):
     model = Note
 
@@ -40,7 +179,7 @@ class NotesDAO(BaseDAO[Note]):
     @classmethod
     async def search_notes_by_name(cls, session: AsyncSession, params: SearchByNameParams) -> list[Note]:
         ss = f"""
-        SELECT * FROM notes
+        SELECT {NOTE_COLUMNS} FROM notes
         WHERE lang_id = :lang_id
         {'AND voc_id = :voc_id' if params.voc_id else ''}
         AND name ILIKE :name
@@ -64,64 +203,169 @@ class NotesDAO(BaseDAO[Note]):
 
     @classmethod
     async def search_notes(cls, session: AsyncSession, params: SearchParams) -> Page[Any]:
-        count_result = await session.execute(cls.search_query(params=params, count=True))
-        total_items = count_result.scalars().one()
+        order_terms = cls.order_terms(params)
+        sort_id = cls.sort_id(params)
+        if params.pagination == 'cursor' and any(expr in CURSOR_EXCLUDED_COLUMNS for expr, _, _, _ in order_terms):
+            # the cursor would carry the whole value of the last note
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=f'Sort <{params.sort}> is not supported by the cursor'
+            )
+        cursor_values = None
+        if params.pagination == 'cursor' and params.cursor:
+            cursor_values = decode_cursor(params.cursor, sort_id, order_terms)
 
-        select_result = await session.execute(cls.search_query(params=params, count=False))
+        # total=window counts by the page query, COUNT(*) OVER() is computed before LIMIT over all found notes,
+        # so it saves a round trip only for searches that read them anyway (a key, a sort without an index).
+        # A listing in the order of an index stops after a page, so the total is counted by a second query.
+        # After a cursor the window sees only the rest of the notes, so the total is counted separately too
+        estimated = params.total == 'estimated' and not params.key
+        with_total = params.total == 'window' and cursor_values is None
+        select_result = await session.execute(
+            cls.search_query(
+                params=params,
+                count=False,
+                order_terms=order_terms,
+                cursor_values=cursor_values,
+                with_total=with_total,
+            )
+        )
         items = [row._mapping for row in select_result]
+
+        offset = params.size * (params.page - 1) if cursor_values is None else None
+        if with_total and items:
+            total_items = items[0]['total_count']
+        elif offset is not None and len(items) < params.size and (items or offset == 0):
+            # the last page, the notes before it fill whole pages
+            total_items = offset + len(items)
+        elif estimated:
+            total_items = await cls.estimate_total(session, params)
+            if offset is not None:
+                total_items = max(total_items, offset + len(items))
+        else:
+            # a full page of total=exact, a page after the end or after a cursor
+            count_result = await session.execute(cls.search_query(params=params, count=True))
+            total_items = count_result.scalars().one()
+
+        next_cursor = None
+        if params.pagination == 'cursor' and len(items) == params.size:
+            next_cursor = encode_cursor(sort_id, [items[-1][f'k{i}'] for i in range(len(order_terms))])
+
         return Page(
             items=items,
             total=total_items,
             page=params.page,
             pages=math.ceil(total_items / params.size),
             size=params.size,
+            next_cursor=next_cursor,
         )
 
     @classmethod
-    def search_query(cls, params: SearchParams, count: bool) -> sqlalchemy.TextClause:
-        select_from_notes = 'SELECT * FROM notes'
-        count_from_notes = 'SELECT COUNT(*) FROM notes'
+    async def estimate_total(cls, session: AsyncSession, params: SearchParams) -> int:
+        """Number of found notes estimated by the planner from the table statistics, the notes are not read"""
+        explain_result = await session.execute(cls.search_query(params=params, count=True, explain=True))
+        # asyncpg returns the json of the plan decoded or as a str, depending on the codec of the connection
+        plan: Any = explain_result.scalars().one()
+        if isinstance(plan, str):
+            plan = orjson.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @classmethod
+    def order_terms(cls, params: SearchParams) -> list[OrderTerm]:
+        """Sort key of the search, it ends with id, so the order is total and a cursor points between two notes"""
+        if params.mode == 'fulltext' and params.key is not None:
+            return [(f'ts_rank(search_vector, {TS_QUERY})', 'desc', None, float), ('id', 'desc', None, int)]
+
+        terms: list[OrderTerm] = []
+        if params.key:
+            terms.append(('CASE WHEN name ILIKE :key THEN 0 WHEN name ILIKE :pattern THEN 1 ELSE 2 END', 'asc', None, int))
+        # notes of one voc have the same voc_id, the term is dropped to keep the key short
+        if not params.voc_id:
+            terms.append(('voc_id', 'asc', None, int))
+        terms.extend(parse_sort(params.sort))
+        if not any(expr == 'id' for expr, _, _, _ in terms):
+            terms.append(('id', 'desc', None, int))
+        return terms
+
+    @classmethod
+    def sort_id(cls, params: SearchParams) -> str:
+        """A cursor is valid only for the search it was made by: the same filters and the same order"""
+        return orjson.dumps(
+            [params.lang_id, params.mode, params.key, params.voc_id, params.level, params.tag_id, params.sort]
+        ).decode()
+
+    @classmethod
+    def search_query(
+        cls,
+        params: SearchParams,
+        count: bool,
+        order_terms: list[OrderTerm] | None = None,
+        cursor_values: list[Any] | None = None,
+        with_total: bool = False,
+        explain: bool = False,
+    ) -> sqlalchemy.TextClause:
+        fulltext = params.mode == 'fulltext' and params.key is not None
+        order_terms = order_terms or cls.order_terms(params)
+        extra_columns = ''.join(f', {expr} AS k{i}' for i, (expr, _, _, _) in enumerate(order_terms))
+        if with_total:
+            extra_columns += ', COUNT(*) OVER() AS total_count'
+        select_from_notes = (
+            f'SELECT {NOTE_COLUMNS}, ts_rank(search_vector, {TS_QUERY}) AS rank, '
+            f"ts_headline(ts_config, text, {TS_QUERY}, '{TS_HEADLINE_OPTIONS}') AS headline{extra_columns} FROM notes"
+            if fulltext
+            else f'SELECT {NOTE_COLUMNS}{extra_columns} FROM notes'
+        )
+        count_from_notes = 'EXPLAIN (FORMAT JSON) SELECT 1 FROM notes' if explain else 'SELECT COUNT(*) FROM notes'
+
+        # the pattern is built here and not by '%' || :key || '%' in SQL, so it is a plain parameter
+        # the planner can match against the trigram indexes of name and text (BitmapOr of two index scans)
+        key_filter = ''
+        if fulltext:
+            key_filter = f'AND search_vector @@ {TS_QUERY}'
+        elif params.key:
+            key_filter = 'AND (name ILIKE :pattern OR text ILIKE :pattern)'
 
         filters = f"""
             WHERE lang_id = :lang_id
             {'AND voc_id = :voc_id' if params.voc_id else ''}
             {'AND level = :level' if params.level else ''}
             {'AND tag_id = :tag_id' if params.tag_id else ''}
-            {"AND (name ILIKE '%' || :key || '%' OR text ILIKE '%' || :key || '%')" if params.key else ''}
+            {key_filter}
             """
 
-        sort_notes = params.sort.replace(':', ' ') if params.sort else 'id desc'
+        if cursor_values is not None:
+            seek = f'AND {seek_predicate(order_terms, cursor_values)}'
+            paginate = 'LIMIT :limit'
+        else:
+            seek = ''
+            paginate = 'LIMIT :limit OFFSET :offset'
+
         sort_and_paginate = f"""
-            ORDER BY
-                {
-            '''
-                CASE
-                    WHEN name ILIKE :key THEN 0
-                    WHEN name ILIKE '%' || :key || '%' THEN 1
-                    ELSE 2
-                END ASC,
-                '''
-            if params.key
-            else ''
-        }
-            voc_id asc, {sort_notes}
-            LIMIT :limit
-            OFFSET :offset;
+            {seek}
+            ORDER BY {', '.join(order_by(term) for term in order_terms)}
+            {paginate};
             """
 
         ss = [count_from_notes, filters] if count else [select_from_notes, filters, sort_and_paginate]
 
-        pp = {
+        pp: dict[str, Any] = {
             'lang_id': params.lang_id,
-            'key': params.key,
             'voc_id': params.voc_id,
             'level': params.level,
             'tag_id': params.tag_id,
         }
+        if fulltext:
+            pp['key'] = params.key
+        elif params.key:
+            if not count:
+                pp['key'] = escape_like(params.key)
+            pp['pattern'] = f'%{escape_like(params.key)}%'
 
         if not count:
             pp['limit'] = params.size
-            pp['offset'] = params.size * (params.page - 1)
+            if cursor_values is not None:
+                pp.update({f'c{i}': v for i, v in enumerate(cursor_values)})
+            else:
+                pp['offset'] = params.size * (params.page - 1)
         pp = {k: v for k, v in pp.items() if v is not None}
 
         return sqlalchemy.text('\n'.join(ss)).bindparams(**pp)
@@ -8,7 +8,16 @@ from sqlalchemy import event
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from src.api.decorators import only_superuser, open_session
 from src.api.notes.dao import NotesDAO, Page, SearchByNameParams, SearchParams
-from src.api.notes.schema import NoteCreate, NoteDelete, NoteRead, NoteReadFull, NoteRename, NoteUpdate
+from src.api.notes.schema import (
+    NoteCreate,
+    NoteDelete,
+    NoteRead,
+    NoteReadFull,
+    NoteRename,
+    NoteSearchRead,
+    NoteUpdate,
+)
+from src.core.lemmatizer import LemmatizerBusyError
 from src.repo.model import Note
 
 router = APIRouter(prefix='', tags=['Notes'])
@@ -30,7 +39,7 @@ async def get_note(session: AsyncSession, note_id: int):
     return await NotesDAO.find_one_or_none_with_media(session, id=note_id)
 
 
-@router.get('/notes/search', response_model=Page[NoteRead])
+@router.get('/notes/search', response_model=Page[NoteSearchRead])
 @open_session
 async def search_notes(session: AsyncSession, params: Annotated[SearchParams, Query()]):
     return await NotesDAO.search_notes(session, params)
@@ -48,9 +57,14 @@ async def search_by_key(session: AsyncSession, params: Annotated[SearchByNamePar
             params.name = n
             res = await NotesDAO.search_notes_by_name(session, params)
         if len(res) == 0:
-            n = ctx.de_tagger.analyze(word)
-            if n and n[0] and n[0] != word:
-                params.name = n[0]
+            analysis: tuple[str, str] | None
+            try:
+                analysis = await ctx.de_lemmatizer.analyze_async(word)
+            except LemmatizerBusyError as e:
+                log.warning('%s', e)
+                analysis = None
+            if analysis and analysis[0] and analysis[0] != word:
+                params.name = analysis[0]
                 res = await NotesDAO.search_notes_by_name(session, params)
     return res
 
@@ -41,12 +41,20 @@ class NoteRead(BaseModel):
         orm_mode = True
 
 
+class NoteSearchRead(NoteRead):
+    # relevance and matched fragments of the text, only in the fulltext mode of the search
+    rank: float | None = None
+    headline: str | None = None
+
+
 class Page[T](BaseModel):
     items: list[T]
     total: int
     page: int
     pages: int
     size: int
+    # cursor of the next page in the cursor pagination, None on the last page
+    next_cursor: str | None = None
 
 
 class NoteReadFull(BaseModel):
@@ -1,8 +1,8 @@
 import logging
 from pathlib import Path
 
-from HanTa import HanoverTagger as ht
-from src.core.database import JsonFileDB, KeyValueDB
+from src.core.database import JsonFileDB, KeyValueDB, SegmentedKeyValueDB, ValueCache
+from src.core.lemmatizer import Lemmatizer
 from src.session import SessionManager
 from src.settings import Settings
 
@@ -22,15 +22,50 @@ media_path = Path('data/media')
 if not media_path.exists():
     Path.mkdir(media_path)
 
-en_pron_db = KeyValueDB(db_path=Path('data/pron/en_pron.bin'))
-de_pron_db = KeyValueDB(db_path=Path('data/pron/de_pron.bin'))
-en_ru_db = JsonFileDB(db_path=Path('data/json/en_ru.json'))
 
-de_tagger = ht.HanoverTagger('morphmodel_ger.pgz')
+def create_pron_db(lang_code: str) -> KeyValueDB | SegmentedKeyValueDB:
+    cache = ValueCache(settings.pron_db_cache_mb * 1024 * 1024) if settings.pron_db_cache_mb > 0 else None
+    if settings.segmented_pron_db:
+        return SegmentedKeyValueDB(
+            db_path=Path(f'data/pron/{lang_code}_pron'),
+            max_segment_size=settings.pron_db_max_segment_mb * 1024 * 1024,
+            use_mmap=settings.mmap_pron_db,
+            read_workers=settings.pron_db_read_workers,
+            normalized_index=settings.normalized_corpus_index,
+            shared_index=settings.shared_pron_db_index,
+            cache=cache,
+        )
+    return KeyValueDB(
+        db_path=Path(f'data/pron/{lang_code}_pron.bin'),
+        use_mmap=settings.mmap_pron_db,
+        read_workers=settings.pron_db_read_workers,
+        normalized_index=settings.normalized_corpus_index,
+        shared_index=settings.shared_pron_db_index,
+        cache=cache,
+    )
+
+
+en_pron_db = create_pron_db('en')
+de_pron_db = create_pron_db('de')
+en_ru_db = JsonFileDB(
+    db_path=Path('data/json/en_ru.json'),
+    normalized_index=settings.normalized_corpus_index,
+    text_index=settings.en_ru_text_index,
+    text_index_workers=settings.en_ru_text_index_workers,
+)
+
+de_lemmatizer = Lemmatizer(
+    model='morphmodel_ger.pgz',
+    max_size=settings.de_lemma_cache_size,
+    workers=settings.de_lemma_workers,
+    timeout=settings.de_lemma_timeout_sec,
+    max_pending=settings.de_lemma_max_pending,
+)
 
 
 async def close_all_connections():
     en_pron_db.close()
     de_pron_db.close()
     en_ru_db.close()
+    de_lemmatizer.close()
     await session_manager.dispose()
@@ -0,0 +1,335 @@
+import array
+import mmap
+import os
+import struct
+from collections.abc import Iterable, Iterator, MutableMapping
+from pathlib import Path
+
+from .NormalizedIndex import normalize_key
+
+FOLD_MIN_CHANGES = 1024
+
+# the normalized keys are a part of the file, the version changes with normalize_key()
+MAPPED_MAGIC = b'KVDBCIX3'
+# magic, size_of_db_file, mtime_ns_of_db_file, number_of_keys, size_of_keys_blob,
+# number_of_normalized_keys (0 or number_of_keys), size_of_normalized_blob
+MAPPED_HEADER = struct.Struct('<8sQQQQQQ')
+
+
+class CompactIndex(MutableMapping[str, tuple[int, int, int]]):
+    """Memory efficient replacement of dict[str, tuple[int, int, int]] for the hash of KeyValueDB.
+
+    Keys are kept utf-8 encoded and sorted in one bytes blob, values in packed arrays:
+
+    keys_blob:        [key_0, key_1, ..., key_n-1]
+    key_offsets:      [0, end_of_key_0, ..., end_of_key_n-1] (n + 1 items)
+    record_positions: [pos_of_record_0, ...]
+    value_positions:  [pos_of_file_bytes_0, ...]
+    value_sizes:      [size_of_file_0, ...]
+
+    A key is found by binary search. The sorted part is immutable: added keys are put into a small dict (overlay),
+    deleted keys are remembered in a set, both are folded into the sorted part when they grow too large.
+
+    If normalized is True, the sorted part also has the normalized keys (see normalize_key) sorted in a blob,
+    every one with the position of its original key, find_normalized() searches them the same way:
+
+    normalized_blob:      [normalized_key_0, ...]
+    normalized_offsets:   [0, end_of_normalized_key_0, ...] (n + 1 items)
+    normalized_positions: [position_of_original_key_0, ...]
+
+    The sorted part can be stored in a file and mapped back read-only (load_mapped),
+    so all processes that map the same file share one copy of it in the page cache:
+
+    [MAPPED_HEADER][key_offsets][record_positions][value_positions][normalized_offsets][normalized_positions]
+    [value_sizes][keys_blob][normalized_blob]
+    """
+
+    def __init__(self, items: Iterable[tuple[str, tuple[int, int, int]]] = (), normalized: bool = False) -> None:
+        self.normalized = normalized
+        self.keys_blob: bytes | mmap.mmap = b''
+        self.blob_start = 0
+        self.key_offsets: array.array | memoryview = array.array('Q', [0])
+        self.record_positions: array.array | memoryview = array.array('Q')
+        self.value_positions: array.array | memoryview = array.array('Q')
+        self.value_sizes: array.array | memoryview = array.array('I')
+        self.normalized_blob: bytes | mmap.mmap = b''
+        self.normalized_blob_start = 0
+        self.normalized_offsets: array.array | memoryview = array.array('Q', [0])
+        self.normalized_positions: array.array | memoryview = array.array('Q')
+        self.overlay: dict[str, tuple[int, int, int]] = {}
+        self.removed: set[str] = set()
+        self.build(items)
+
+    def build(self, items: Iterable[tuple[str, tuple[int, int, int]]]):
+        blob = bytearray()
+        key_offsets = array.array('Q', [0])
+        record_positions = array.array('Q')
+        value_positions = array.array('Q')
+        value_sizes = array.array('I')
+
+        # utf-8 preserves the order of code points, so bytes are sorted like str
+        for key_in_bytes, (record_pos, value_pos, value_len) in sorted((k.encode(), v) for k, v in items):
+            blob += key_in_bytes
+            key_offsets.append(len(blob))
+            record_positions.append(record_pos)
+            value_positions.append(value_pos)
+            value_sizes.append(value_len)
+
+        normalized_blob = bytearray()
+        normalized_offsets = array.array('Q', [0])
+        normalized_positions = array.array('Q')
+        if self.normalized:
+            # keys with the same normalized form are kept in the order of the original keys
+            normalized_keys = sorted(
+                (normalize_key(blob[key_offsets[i] : key_offsets[i + 1]].decode()).encode(), i)
+                for i in range(len(record_positions))
+            )
+            for normalized_key_in_bytes, i in normalized_keys:
+                normalized_blob += normalized_key_in_bytes
+                normalized_offsets.append(len(normalized_blob))
+                normalized_positions.append(i)
+
+        self.keys_blob = bytes(blob)
+        self.blob_start = 0
+        self.key_offsets = key_offsets
+        self.record_positions = record_positions
+        self.value_positions = value_positions
+        self.value_sizes = value_sizes
+        self.normalized_blob = bytes(normalized_blob)
+        self.normalized_blob_start = 0
+        self.normalized_offsets = normalized_offsets
+        self.normalized_positions = normalized_positions
+        self.overlay = {}
+        self.removed = set()
+
+    def fold(self):
+        self.build(list(self.iter_items()))
+
+    def iter_items(self) -> Iterator[tuple[str, tuple[int, int, int]]]:
+        """Same as items(), but the sorted part is read by position instead of a binary search per key"""
+        for i in range(self.base_size()):
+            key = self.base_key(i).decode()
+            if key not in self.removed:
+                yield key, (self.record_positions[i], self.value_positions[i], self.value_sizes[i])
+        yield from list(self.overlay.items())
+
+    def snapshot(self) -> 'CompactIndex':
+        """A copy that is not affected by later changes. The sorted part is never changed in place,
+        so it is shared, only the overlay and the removed keys are copied."""
+        index = CompactIndex()
+        index.normalized = self.normalized
+        index.keys_blob = self.keys_blob
+        index.blob_start = self.blob_start
+        index.key_offsets = self.key_offsets
+        index.record_positions = self.record_positions
+        index.value_positions = self.value_positions
+        index.value_sizes = self.value_sizes
+        index.normalized_blob = self.normalized_blob
+        index.normalized_blob_start = self.normalized_blob_start
+        index.normalized_offsets = self.normalized_offsets
+        index.normalized_positions = self.normalized_positions
+        index.overlay = dict(self.overlay)
+        index.removed = set(self.removed)
+        return index
+
+    def base_size(self) -> int:
+        return len(self.record_positions)
+
+    def base_key(self, i: int) -> bytes:
+        return self.keys_blob[self.blob_start + self.key_offsets[i] : self.blob_start + self.key_offsets[i + 1]]
+
+    def store(self, path: Path, db_file_size: int, db_file_mtime_ns: int):
+        """Writes the index to a file for load_mapped(), the size and mtime of the db-file validate it"""
+        if self.overlay or self.removed:
+            self.fold()
+
+        blob_size = self.key_offsets[-1]
+        normalized_blob_size = self.normalized_offsets[-1]
+        # every process writes its own tmp-file, the last replace wins
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as f:
+            f.write(
+                MAPPED_HEADER.pack(
+                    MAPPED_MAGIC,
+                    db_file_size,
+                    db_file_mtime_ns,
+                    self.base_size(),
+                    blob_size,
+                    len(self.normalized_positions),
+                    normalized_blob_size,
+                )
+            )
+            # the arrays of 8-byte items go first, so they stay aligned in the mapping
+            f.write(self.key_offsets)
+            f.write(self.record_positions)
+            f.write(self.value_positions)
+            f.write(self.normalized_offsets)
+            f.write(self.normalized_positions)
+            f.write(self.value_sizes)
+            f.write(self.keys_blob[self.blob_start : self.blob_start + blob_size])
+            start = self.normalized_blob_start
+            f.write(self.normalized_blob[start : start + normalized_blob_size])
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_mapped(
+        cls, path: Path, db_file_size: int, db_file_mtime_ns: int, normalized: bool = False
+    ) -> 'CompactIndex | None':
+        """Maps the index stored by store(), returns None if the file is missing, describes another db-file
+        or has no normalized keys while they are required"""
+        if not path.exists() or path.stat().st_size < MAPPED_HEADER.size:
+            return None
+
+        with path.open('rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[: len(MAPPED_MAGIC)] != MAPPED_MAGIC:
+            mm.close()
+            return None
+        _, size, mtime_ns, n, blob_size, m, normalized_blob_size = MAPPED_HEADER.unpack_from(mm)
+        q_size = array.array('Q').itemsize
+        i_size = array.array('I').itemsize
+        expected_file_size = (
+            MAPPED_HEADER.size
+            + (n + 1) * q_size
+            + 2 * n * q_size
+            + (m + 1) * q_size
+            + m * q_size
+            + n * i_size
+            + blob_size
+            + normalized_blob_size
+        )
+        if (
+            size != db_file_size
+            or mtime_ns != db_file_mtime_ns
+            or len(mm) != expected_file_size
+            or (normalized and m != n)
+        ):
+            mm.close()
+            return None
+
+        index = cls(normalized=normalized)
+        view = memoryview(mm)
+        pos = MAPPED_HEADER.size
+        index.key_offsets = view[pos : pos + (n + 1) * q_size].cast('Q')
+        pos += (n + 1) * q_size
+        index.record_positions = view[pos : pos + n * q_size].cast('Q')
+        pos += n * q_size
+        index.value_positions = view[pos : pos + n * q_size].cast('Q')
+        pos += n * q_size
+        normalized_offsets = view[pos : pos + (m + 1) * q_size].cast('Q')
+        pos += (m + 1) * q_size
+        normalized_positions = view[pos : pos + m * q_size].cast('Q')
+        pos += m * q_size
+        index.value_sizes = view[pos : pos + n * i_size].cast('I')
+        pos += n * i_size
+        index.keys_blob = mm
+        index.blob_start = pos
+        if normalized:
+            index.normalized_offsets = normalized_offsets
+            index.normalized_positions = normalized_positions
+            index.normalized_blob = mm
+            index.normalized_blob_start = pos + blob_size
+        return index
+
+    def bisect(self, key_in_bytes: bytes) -> int:
+        """Returns position of the first key in the sorted part that is >= key_in_bytes"""
+        lo, hi = 0, self.base_size()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.base_key(mid) < key_in_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def normalized_key(self, i: int) -> bytes:
+        start = self.normalized_blob_start
+        return self.normalized_blob[start + self.normalized_offsets[i] : start + self.normalized_offsets[i + 1]]
+
+    def find_normalized(self, normalized_key: str) -> str | None:
+        """The first original key of the sorted part with the normalized form, the keys of the overlay are not searched"""
+        normalized_key_in_bytes = normalized_key.encode()
+        lo, hi = 0, len(self.normalized_positions)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.normalized_key(mid) < normalized_key_in_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < len(self.normalized_positions) and self.normalized_key(lo) == normalized_key_in_bytes:
+            key = self.base_key(self.normalized_positions[lo]).decode()
+            if key not in self.removed:
+                return key
+            lo += 1
+        return None
+
+    def keys_with_prefix(self, prefix: str, limit: int) -> list[str]:
+        """Sorted keys that start with prefix, the sorted part is read from the first matching position only"""
+        prefix_in_bytes = prefix.encode()
+        keys: list[str] = []
+        i = self.bisect(prefix_in_bytes)
+        # removed keys are skipped without being counted, the first limit keys of the rest are enough
+        while i < self.base_size() and len(keys) < limit:
+            key_in_bytes = self.base_key(i)
+            if not key_in_bytes.startswith(prefix_in_bytes):
+                break
+            key = key_in_bytes.decode()
+            if key not in self.removed:
+                keys.append(key)
+            i += 1
+        keys.extend(k for k in self.overlay if k.startswith(prefix))
+        keys.sort()
+        return keys[:limit]
+
+    def base_find(self, key: str) -> int:
+        key_in_bytes = key.encode()
+        i = self.bisect(key_in_bytes)
+        return i if i < self.base_size() and self.base_key(i) == key_in_bytes else -1
+
+    def __getitem__(self, key: str) -> tuple[int, int, int]:
+        value = self.overlay.get(key)
+        if value is not None:
+            return value
+        if key not in self.removed:
+            i = self.base_find(key)
+            if i >= 0:
+                return self.record_positions[i], self.value_positions[i], self.value_sizes[i]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: tuple[int, int, int]):
+        if key not in self.overlay and key not in self.removed and self.base_find(key) >= 0:
+            # the new value shadows the sorted one
+            self.removed.add(key)
+        self.overlay[key] = value
+        self.fold_if_needed()
+
+    def __delitem__(self, key: str):
+        if key in self.overlay:
+            del self.overlay[key]
+        elif key not in self.removed and self.base_find(key) >= 0:
+            self.removed.add(key)
+        else:
+            raise KeyError(key)
+        self.fold_if_needed()
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.base_size()):
+            key = self.base_key(i).decode()
+            if key not in self.removed:
+                yield key
+        yield from list(self.overlay)
+
+    def __len__(self) -> int:
+        return self.base_size() - len(self.removed) + len(self.overlay)
+
+    def update_many(self, items: dict[str, tuple[int, int, int]]):
+        """Same as update(), but folds once at the end instead of every few thousand keys"""
+        for key, value in items.items():
+            if key not in self.overlay and key not in self.removed and self.base_find(key) >= 0:
+                self.removed.add(key)
+            self.overlay[key] = value
+        self.fold_if_needed()
+
+    def fold_if_needed(self):
+        if len(self.overlay) + len(self.removed) > max(FOLD_MIN_CHANGES, self.base_size() // 8):
+            self.fold()
@@ -1,44 +1,412 @@
+import contextlib
 import json
 import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO
+
+import orjson
+
+from .InvertedIndex import InvertedIndex, index_records
+from .KeyValueDB import InvalidDBOperationError, KeyValueDB, file_lock
 
 log = logging.getLogger('uvicorn')
 
+TEXT_INDEX_CHUNK_SIZE = 5000
+JOURNAL_OP_WRITE = 'write'
+JOURNAL_OP_REMOVE = 'remove'
+
 class JsonFileDB:
-    def __init__(self, db_path: Path) -> None:
+    """DB Scheme: a json array of items, every item is an object with a unique 'key' field.
+
+    The items are not kept in memory. On the first connect the json-file is converted into a KeyValueDB
+    (db_path + '.kvdb'), where every item is stored as orjson-serialized bytes under its key, with a compact index
+    key -> offset. read() decodes only the requested item, read_raw() returns its bytes as is.
+
+    The size and mtime of the json-file the KeyValueDB was built from are kept in db_path + '.kvdb.src',
+    the KeyValueDB is rebuilt if the json-file has been replaced since then.
+
+    write() and remove() append the operation to a journal (db_path + '.journal', one json object per line)
+    and apply it to the KeyValueDB, so an edit costs O(item). On connect the operations that have not been applied
+    yet (the applied size of the journal is kept in the stamp) are replayed, applying an operation twice is harmless.
+    When the journal outgrows max_journal_size and on close, store() folds it into the json-file:
+    the json-file is rewritten from the KeyValueDB via a tmp-file that replaces it, then the journal is truncated.
+
+    Several processes (uvicorn workers) may connect to the same json-file. Building, replaying and folding
+    are done under an flock (db_path + '.kvdb.lock'). Journal operations left by a process that has not folded
+    them (an unclean exit) are replayed and folded on connect by the first process, other processes find the journal
+    empty. A process folds on close only if it has written to the journal itself; before folding it applies
+    the operations of other processes from the journal, and if another process has folded meanwhile,
+    it rebuilds the KeyValueDB from the new json-file first.
+
+    If text_index is True, a full-text InvertedIndex over the descriptions and examples is built after connecting:
+    in a background thread, by text_index_workers processes, chunk by chunk. search_text() returns None until
+    the index is ready.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        normalized_index: bool = False,
+        text_index: bool = False,
+        text_index_workers: int = 4,
+        max_journal_size: int = 4 * 1024 * 1024,
+    ) -> None:
         self.db_file_path = db_path
-        self.db_file = None
-        self.hash: dict[str, Any] = {}
+        self.kv_db_path = db_path.with_name(db_path.name + '.kvdb')
+        self.source_stamp_path = db_path.with_name(db_path.name + '.kvdb.src')
+        self.journal_path = db_path.with_name(db_path.name + '.journal')
+        self.journal_file: BinaryIO | None = None
+        # bytes appended to the journal by this process since the last fold
+        self.journal_written = 0
+        # stamp of the json-file this process has built, replayed or folded, another stamp means another process folded
+        self.folded_stamp: dict[str, int] | None = None
+        self.closing = False
+        self.max_journal_size = max_journal_size
+        self.normalized_index = normalized_index
+        self.kv_db: KeyValueDB | None = None
+        # guards the journal and the KeyValueDB against concurrent edits
+        self.lock = threading.RLock()
+        self.text_index: InvertedIndex | None = InvertedIndex() if text_index else None
+        self.text_index_workers = text_index_workers
+        self.text_index_ready = threading.Event()
+        self.text_index_thread: threading.Thread | None = None
 
     def connect(self):
-        self.hash = {}
-
-        if not self.db_file_path.exists:
-            f = self.db_file_path.open('w')
-            f.close()
-
-        with self.db_file_path.open('rt') as file:
-            data = json.loads(file.read())
-            file.seek(0, 2)
-            log.info(f'JsonFileDB file size: {file.tell()} bytes, {file.tell() / 1024 / 1024} Mb')
-            for item in data:
-                self.hash[item['key']] = item
-        self.store()
+        if self.kv_db:
+            return
+
+        self.closing = False
+        with self.kv_lock():
+            # uvicorn workers connect at the same time, only the first one builds the KeyValueDB
+            stamp = self.read_source_stamp()
+            journal_applied = 0
+            if stamp is None or stamp.get('db_file') != self.source_stamp():
+                self.build()
+            else:
+                journal_applied = stamp.get('journal_applied', 0)
+            self.folded_stamp = self.source_stamp()
+            self.kv_db = self.create_kv_db()
+            self.kv_db.connect()
+            self.journal_file = self.journal_path.open('ab')
+            self.journal_written = 0
+            if self.replay_journal(journal_applied):
+                # the operations are left by a process that has not folded them, they are folded by the replaying
+                # process right away, so other processes find the journal empty
+                self.fold_locked()
+        log.info('JsonFileDB %s: %s items', self.db_file_path.name, len(self.kv_db.hash))
+        self.start_text_index()
+
+    @contextlib.contextmanager
+    def kv_lock(self):
+        """Excludes other processes from building, replaying and folding"""
+        self.kv_db_path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.kv_db_path.with_name(self.kv_db_path.name + '.lock')):
+            yield
+
+    def start_text_index(self):
+        if self.text_index is None:
+            return
+        self.text_index_ready.clear()
+        records = self.reserve_text_index()
+        self.text_index_thread = threading.Thread(
+            target=self.build_text_index, args=(records,), name='JsonFileDB', daemon=True
+        )
+        self.text_index_thread.start()
+
+    def reserve_text_index(self) -> list[tuple[int, int]]:
+        """Assigns doc ids to the current keys, returns positions and sizes of their values in the same order.
+        Edits made from now on are applied to the text index right away, the postings are merged later."""
+        items = sorted(self.kv_db.records())  # type: ignore[union-attr]
+        self.text_index.reserve([key for key, _ in items])  # type: ignore[union-attr]
+        return [(value_pos, value_len) for _, (_, value_pos, value_len) in items]
+
+    def build_text_index(self, records: list[tuple[int, int]]):
+        started_at = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.text_index_workers, mp_context=multiprocessing.get_context('spawn')
+            ) as pool:
+                futures = [
+                    pool.submit(index_records, self.kv_db_path, i, records[i : i + TEXT_INDEX_CHUNK_SIZE])
+                    for i in range(0, len(records), TEXT_INDEX_CHUNK_SIZE)
+                ]
+                for future in as_completed(futures):
+                    self.text_index.merge(future.result())  # type: ignore[union-attr]
+        except Exception:
+            log.exception('JsonFileDB %s: building of the text index has failed', self.db_file_path.name)
+            return
+
+        self.text_index_ready.set()
+        log.info(
+            'JsonFileDB %s: text index of %s items, %s tokens is built in %.2f sec',
+            self.db_file_path.name,
+            len(records),
+            len(self.text_index.postings),  # type: ignore[union-attr]
+            time.perf_counter() - started_at,
+        )
+
+    def search_text(self, query: str, limit: int = 20) -> list[tuple[str, float]] | None:
+        """Keys of the items whose description or examples contain the words of the query, best first.
+        Returns None if the text index is disabled or not built yet."""
+        if self.text_index is None or not self.text_index_ready.is_set():
+            return None
+        return self.text_index.search(query, limit)
+
+    def create_kv_db(self) -> KeyValueDB:
+        # reading is done in the event loop, the db does not need its own threads
+        return KeyValueDB(self.kv_db_path, compact_index=True, read_workers=1, normalized_index=self.normalized_index)
+
+    def source_stamp(self) -> dict[str, int] | None:
+        if not self.db_file_path.exists():
+            return None
+        stat = self.db_file_path.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def read_source_stamp(self) -> dict[str, Any] | None:
+        if not self.source_stamp_path.exists() or not self.kv_db_path.exists():
+            return None
+        try:
+            return json.loads(self.source_stamp_path.read_text())
+        except ValueError:
+            return None
+
+    def store_source_stamp(self, journal_applied: int = 0):
+        tmp_path = self.source_stamp_path.with_name(f'{self.source_stamp_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'db_file': self.source_stamp(), 'journal_applied': journal_applied}))
+        os.replace(tmp_path, self.source_stamp_path)
+
+    def replay_journal(self, journal_applied: int) -> int:
+        """Applies the operations appended to the journal after journal_applied bytes, returns their number"""
+        if not self.journal_path.exists():
+            self.store_source_stamp()
+            return 0
+
+        with self.journal_path.open('r+b') as f:
+            f.seek(journal_applied)
+            pos = journal_applied
+            count = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # the last operation has not been written completely
+                    log.warning('JsonFileDB %s: incomplete journal entry is dropped', self.db_file_path.name)
+                    f.truncate(pos)
+                    break
+                op = orjson.loads(line)
+                if op['op'] == JOURNAL_OP_WRITE:
+                    self.apply_write(op['item'])
+                elif op['op'] == JOURNAL_OP_REMOVE:
+                    self.apply_remove(op['key'])
+                pos += len(line)
+                count += 1
+        if count:
+            log.info('JsonFileDB %s: %s journal operations are replayed', self.db_file_path.name, count)
+        self.store_source_stamp(pos)
+        return count
+
+    def build(self):
+        """Converts the json-file into the KeyValueDB, the stamp is written last,
+        so an interrupted build is started again on the next connect.
+
+        The whole json-file has to be parsed, this is done in a child process:
+        the memory of the parsed items is returned to the OS when it exits.
+        """
+        started_at = time.perf_counter()
+        self.source_stamp_path.unlink(missing_ok=True)
+        for suffix in ('', '.idx', '.cidx'):
+            self.kv_db_path.with_name(self.kv_db_path.name + suffix).unlink(missing_ok=True)
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            count = pool.submit(convert_json_file, self.db_file_path, self.kv_db_path).result()
+        self.store_source_stamp()
+        log.info(
+            'JsonFileDB %s: %s items are indexed in %.2f sec',
+            self.db_file_path.name,
+            count,
+            time.perf_counter() - started_at,
+        )
 
     def has(self, key: str) -> bool:
-        return self.hash.get(key) != None
+        return self.kv_db is not None and self.kv_db.has(key)
+
+    def find(self, key: str) -> str | None:
+        return self.kv_db.find(key) if self.kv_db else None
+
+    def keys_with_prefix(self, prefix: str, limit: int = 10) -> list[str]:
+        """Sorted keys that start with prefix, found by binary search in the compact index"""
+        return self.kv_db.keys_with_prefix(prefix, limit) if self.kv_db else []
+
+    def read_raw(self, key: str) -> bytes | None:
+        """Serialized item as it is stored, can be sent to a client without decoding"""
+        if not self.kv_db:
+            return None
+        bb = self.kv_db.read(key)
+        return bytes(bb) if isinstance(bb, memoryview) else bb
+
+    def etag(self, key: str) -> str | None:
+        """Changes when the item is rewritten or the KeyValueDB is rebuilt from a new json-file"""
+        return self.kv_db.etag(key) if self.kv_db else None
 
     def read(self, key: str) -> Any | None:
-        return self.hash.get(key)
+        bb = self.read_raw(key)
+        return orjson.loads(bb) if bb is not None else None
+
+    def write(self, item: dict[str, Any]):
+        """Adds the item or replaces the item with the same key"""
+        if not self.kv_db:
+            raise InvalidDBOperationError(details='JsonFileDB should be connected before writing!')
+
+        with self.lock:
+            # a fold of another process must not truncate the operation before it has been replayed
+            with self.kv_lock():
+                self.append_to_journal({'op': JOURNAL_OP_WRITE, 'item': item})
+                self.apply_write(item)
+            self.fold_if_needed()
 
     def remove(self, key: str):
-        del self.hash[key]
+        if not self.kv_db:
+            raise InvalidDBOperationError(details='JsonFileDB should be connected before removing!')
+
+        with self.lock:
+            if not self.kv_db.has(key):
+                raise KeyError(key)
+            with self.kv_lock():
+                self.append_to_journal({'op': JOURNAL_OP_REMOVE, 'key': key})
+                self.apply_remove(key)
+            self.fold_if_needed()
+
+    def append_to_journal(self, op: dict[str, Any]):
+        if not self.journal_file:
+            raise InvalidDBOperationError(details='JsonFileDB should be connected before writing!')
+
+        # the operation is durable before it is applied
+        line = orjson.dumps(op) + b'\n'
+        self.journal_file.write(line)
+        self.journal_written += len(line)
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def apply_write(self, item: dict[str, Any]):
+        key = item['key']
+        bb = orjson.dumps(item)
+        if self.kv_db.read(key) == bb:  # type: ignore[union-attr]
+            return
+        self.kv_db.remove(key)  # type: ignore[union-attr]
+        self.kv_db.write(key, bb)  # type: ignore[union-attr]
+        if self.text_index is not None:
+            self.text_index.add(key, item)
+
+    def apply_remove(self, key: str):
+        if self.kv_db.remove(key) and self.text_index is not None:  # type: ignore[union-attr]
+            self.text_index.remove(key)
+
+    def journal_size(self) -> int:
+        return self.journal_file.tell() if self.journal_file else 0
+
+    def fold_if_needed(self):
+        if self.journal_size() > self.max_journal_size:
+            self.store()
 
     def store(self):
-        with self.db_file_path.open('wt') as file:
-            data = json.dumps(list(self.hash.values()), ensure_ascii=False)
-            file.write(data)
+        """Folds the journal into the json-file, if this process has written to it"""
+        with self.lock:
+            if not self.kv_db or not self.journal_file or self.journal_written == 0:
+                return
+            with self.kv_lock():
+                self.fold_locked()
+
+    def fold_locked(self):
+        """Folds the journal, the caller holds kv_lock()"""
+        stamp = self.read_source_stamp()
+        if stamp is None or stamp.get('db_file') != self.folded_stamp:
+            # another process has folded: its json-file contains the journal operations appended before that,
+            # including the operations of this process, the later ones are still in the journal
+            log.info('JsonFileDB %s: the db-file has been folded by another process', self.db_file_path.name)
+            self.rebuild_kv_db()
+            journal_applied = 0
+        else:
+            journal_applied = stamp.get('journal_applied', 0)
+        # the operations of other processes, the operations of this one are applied already and are skipped
+        self.replay_journal(journal_applied)
+        self.fold()
+
+    def rebuild_kv_db(self):
+        if self.text_index_thread:
+            # the text index reads the KeyValueDB by positions, the file must not be replaced under it
+            self.text_index_thread.join()
+        self.kv_db.close()  # type: ignore[union-attr]
+        self.build()
+        self.kv_db = self.create_kv_db()
+        self.kv_db.connect()
+        if not self.closing:
+            self.start_text_index()
+
+    def fold(self):
+        if not self.journal_file:
+            raise InvalidDBOperationError(details='JsonFileDB should be connected before folding!')
+
+        started_at = time.perf_counter()
+        self.db_file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.db_file_path.with_name(f'{self.db_file_path.name}.{os.getpid()}.tmp')
+        # items are written one by one in the order of the json-file, the whole array is never built in memory
+        records = sorted(self.kv_db.records(), key=lambda r: r[1][0])  # type: ignore[union-attr]
+        with tmp_path.open('wb') as file:
+            file.write(b'[')
+            for i, (key, _) in enumerate(records):
+                if i > 0:
+                    file.write(b',')
+                file.write(self.kv_db.read(key))  # type: ignore[arg-type, union-attr]
+            file.write(b']')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.db_file_path)
+        # the KeyValueDB already contains the changes, it is in sync with the new json-file.
+        # If the process dies before the stamp is stored, the KeyValueDB is rebuilt and the journal is replayed again
+        self.store_source_stamp()
+        self.folded_stamp = self.source_stamp()
+        self.journal_file.truncate(0)
+        self.journal_file.seek(0)
+        self.journal_written = 0
+        # the records of replaced and removed items are not needed anymore,
+        # but the text index may still be reading the KeyValueDB by the positions taken on connect
+        if not self.text_index_thread or not self.text_index_thread.is_alive():
+            self.kv_db.compact()  # type: ignore[union-attr]
+        log.info(
+            'JsonFileDB %s: journal is folded into the db-file in %.2f sec',
+            self.db_file_path.name,
+            time.perf_counter() - started_at,
+        )
 
     def close(self):
-        pass
+        self.closing = True
+        self.store()
+        with self.lock:
+            if self.journal_file:
+                self.journal_file.close()
+                self.journal_file = None
+            if self.kv_db:
+                self.kv_db.close()
+                self.kv_db = None
+
+
+def convert_json_file(json_file_path: Path, kv_db_path: Path) -> int:
+    """Writes every item of the json-file into the KeyValueDB as orjson bytes, returns the number of items"""
+    items: dict[str, bytes] = {}
+    if json_file_path.exists():
+        bb = json_file_path.read_bytes()
+        data = orjson.loads(bb) if bb.strip() else []
+        del bb
+        # a later item with the same key replaces the former one
+        items = {item['key']: orjson.dumps(item) for item in data}
+        del data
+
+    kv_db = KeyValueDB(kv_db_path, compact_index=True, read_workers=1)
+    kv_db.connect()
+    try:
+        return kv_db.write_many(items.items())
+    finally:
+        kv_db.close()
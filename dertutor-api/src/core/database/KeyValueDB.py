@@ -1,12 +1,57 @@
 import array
+import asyncio
+import contextlib
+import fcntl
 import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Iterable, MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
+from .CompactIndex import CompactIndex
+from .NormalizedIndex import NormalizedIndex
+from .ValueCache import ValueCache
+
 log = logging.getLogger('uvicorn')
 
 INT_SIZE = 4
 META_DATA_SIZE = 1
 
+INDEX_MAGIC = b'KVDBIDX1'
+INDEX_HEADER = struct.Struct('<8sQQQ')  # magic, size_of_db_file, mtime_ns_of_db_file, generation
+INDEX_ENTRY = struct.Struct('<BQQII')  # meta_data, pos_of_record, pos_of_file_bytes, size_of_file, size_of_file_key
+
+RECORD_HEADER = struct.Struct('<BI')  # meta_data, size_of_file_key
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# changes made during the copying of a compaction that are left for the swap under the lock
+COMPACTION_SWAP_CHANGES = 256
+IOV_MAX = 1024  # max number of buffers of one pwritev call on linux
+
+
+@contextlib.contextmanager
+def file_lock(path: Path):
+    """Exclusive flock of the file, it excludes other processes and other open files of the same process"""
+    with path.open('a') as f:
+        # the lock is released by closing the file
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+@dataclass
+class CompactionReport:
+    db_path: str
+    size_before: int
+    size_after: int
+    reclaimed_bytes: int
+    keys: int
+    duration_sec: float
+
 
 class KeyValueDB:
     """DB Scheme:
@@ -26,24 +71,220 @@ class KeyValueDB:
     ...
 
     META_DATA contains one number: 0 if file is marked as deleted or 1 - otherwise
+
+    The hash of the db is persisted in a sidecar index-file (db_path + '.idx'):
+
+    [magic, size_of_db_file, mtime_ns_of_db_file, generation (INDEX_HEADER)]
+    [meta_data, pos_of_record, pos_of_file_bytes, size_of_file, size_of_file_key (INDEX_ENTRY), encoded_file_key]
+    ...
+
+    write() and remove() append an entry and update the header, entries are replayed in order on connect.
+    The index is valid only if the size and mtime of the db-file match the header,
+    otherwise the db-file is scanned and the index is rebuilt.
+
+    If use_mmap is True, the db-file is mapped into memory (read only) and read()
+    returns a zero-copy memoryview slice of the mapping instead of a new bytes object.
+
+    Records marked as deleted stay in the db-file until compact() is called.
+
+    If compact_index is True, the hash is a CompactIndex (sorted key blob and packed arrays)
+    instead of a dict, it takes several times less memory at the cost of a binary search per lookup.
+
+    If shared_index is True, the CompactIndex is also stored in <db>.cidx and mapped from there read-only.
+    Processes that connect to the same db-file (uvicorn workers) share the pages of one index
+    instead of building their own copies. Keys written after connecting are kept in the private overlay.
+
+    If normalized_index is True, a secondary index of normalized keys (casefolded, ß and umlauts folded)
+    is maintained, find() uses it when a key is not found as is. With a CompactIndex the normalized keys
+    are a part of its sorted part, so with shared_index they are mapped from <db>.cidx and shared too.
+
+    read_async() performs the reading in a pool of read_workers threads, so the event loop is not blocked
+    by a cold page cache. Values are read with os.pread, there is no shared seek pointer between readers.
+
+    If a cache (ValueCache) is given, values read with os.pread are kept in it and hot values are returned
+    without touching the db-file. In mmap mode the cache is not used: mapped values are already served from memory.
     """
 
-    def __init__(self, db_path: Path) -> None:
+    def __init__(
+        self,
+        db_path: Path,
+        use_mmap: bool = False,
+        compact_index: bool = False,
+        read_workers: int = 8,
+        normalized_index: bool = False,
+        shared_index: bool = False,
+        cache: ValueCache | None = None,
+    ) -> None:
         log.info('new KeyValueDB: %s', db_path)
         self.db_file_path = db_path
-        self.hash: dict[str, tuple[int, int, int]] = {}  # pos_of_record, pos_of_file_bytes, size_of_file
+        # pos_of_record, pos_of_file_bytes, size_of_file
+        self.hash: MutableMapping[str, tuple[int, int, int]] = {}
+        self.compact_index = compact_index or shared_index
+        self.shared_index = shared_index
+        self.shared_index_path = db_path.with_name(db_path.name + '.cidx')
+        self.normalized: NormalizedIndex | None = NormalizedIndex() if normalized_index else None
         self.max_bytes_len = 256 ** (array.array('I').itemsize) - 1
         self.db_file = None
+        self.use_mmap = use_mmap
+        self.mm: mmap.mmap | None = None
+        self.index_file_path = db_path.with_name(db_path.name + '.idx')
+        self.index_file = None
+        self.generation = 0
+        self.file_id = 0
+        # guards the file handles and the hash against a concurrent compaction
+        self.lock = threading.RLock()
+        # odd while the hash is being changed, lets etag() read the hash without the lock
+        self.version = 0
+        # records written and removed during a compaction: (meta_data, key, value)
+        self.changes: list[tuple[int, str, tuple[int, int, int]]] | None = None
+        self.read_workers = read_workers
+        self.executor: ThreadPoolExecutor | None = None
+        # db-files replaced by compaction, a pread of a concurrent reader may still use them
+        self.retired_files: list = []
+        self.cache = cache
 
     def connect(self):
         if self.db_file:
             return
 
-        if not self.db_file_path.exists:
-            f = self.db_file_path.open('w')
-            f.close()
+        if not self.db_file_path.exists():
+            self.db_file_path.parent.mkdir(parents=True, exist_ok=True)
+            self.db_file_path.touch()
 
         log.info('Connecting to: %s...', self.db_file_path.as_posix())
+        with self.index_lock():
+            if not self.load_shared_index() and not self.load_index():
+                self.scan()
+                self.store_index()
+
+        self.index_file = self.index_file_path.open('r+b')
+        self.db_file = self.db_file_path.open('r+b')
+        self.file_id = os.fstat(self.db_file.fileno()).st_ino
+        self.executor = ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix='KeyValueDB')
+        self.db_file.seek(0, 2)
+        log.info('DB file size: %s bytes, %s Mb', self.db_file.tell(), self.db_file.tell() / 1024 / 1024)
+        if self.use_mmap:
+            self.remap()
+
+    @contextlib.contextmanager
+    def index_lock(self):
+        """While one process scans the db-file and stores the index, other processes that connect
+        to the same db-file (uvicorn workers) wait for it and load the stored index instead of building their own"""
+        with file_lock(self.index_file_path.with_name(self.index_file_path.name + '.lock')):
+            yield
+
+    def load_shared_index(self) -> bool:
+        """Maps the shared index, returns False if it is missing or stale"""
+        if not self.shared_index or not self.index_file_path.exists():
+            return False
+
+        db_file_stat = self.db_file_path.stat()
+        # the index-file is still needed for appending, its header has to be valid too
+        with self.index_file_path.open('rb') as f:
+            header = f.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size:
+            return False
+        magic, db_file_size, db_file_mtime_ns, generation = INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC or db_file_size != db_file_stat.st_size or db_file_mtime_ns != db_file_stat.st_mtime_ns:
+            return False
+
+        hash = CompactIndex.load_mapped(
+            self.shared_index_path,
+            db_file_stat.st_size,
+            db_file_stat.st_mtime_ns,
+            normalized=self.normalized is not None,
+        )
+        if hash is None:
+            log.info('KeyValueDB: shared index %s is missing or stale', self.shared_index_path.as_posix())
+            return False
+
+        self.hash = hash
+        if self.normalized is not None:
+            self.normalized = NormalizedIndex(base=hash)
+        self.generation = generation
+        log.info('KeyValueDB: %s keys are mapped from shared index', len(hash))
+        return True
+
+    def load_index(self) -> bool:
+        """Loads the hash from the index-file in one read, returns False if the index is missing or stale"""
+        if not self.index_file_path.exists():
+            log.info('KeyValueDB: index %s not found', self.index_file_path.as_posix())
+            return False
+
+        data = self.index_file_path.read_bytes()
+        db_file_stat = self.db_file_path.stat()
+        try:
+            magic, db_file_size, db_file_mtime_ns, generation = INDEX_HEADER.unpack_from(data)
+            if magic != INDEX_MAGIC or db_file_size != db_file_stat.st_size or db_file_mtime_ns != db_file_stat.st_mtime_ns:
+                log.info('KeyValueDB: index %s is stale', self.index_file_path.as_posix())
+                return False
+
+            hash: dict[str, tuple[int, int, int]] = {}
+            cursor = INDEX_HEADER.size
+            while cursor < len(data):
+                status, record_pos, value_pos, value_len, key_len = INDEX_ENTRY.unpack_from(data, cursor)
+                cursor += INDEX_ENTRY.size
+                if cursor + key_len > len(data):
+                    raise struct.error('the last entry is truncated')
+                key = data[cursor : cursor + key_len].decode()
+                cursor += key_len
+                if status == 1:
+                    hash[key] = (record_pos, value_pos, value_len)
+                else:
+                    hash.pop(key, None)
+        except (struct.error, UnicodeDecodeError) as e:
+            log.info('KeyValueDB: index %s is corrupted: %s', self.index_file_path.as_posix(), e)
+            return False
+
+        self.set_hash(hash)
+        self.generation = generation
+        log.info('KeyValueDB: %s keys are loaded from index, generation: %s', len(hash), generation)
+        return True
+
+    def store_index(self):
+        """Rewrites the index-file with the live keys only"""
+        self.generation += 1
+        # every process writes its own tmp-file, the last replace wins
+        tmp_path = self.index_file_path.with_name(f'{self.index_file_path.name}.{os.getpid()}.tmp')
+        self.write_index_file(tmp_path, self.hash, self.db_file_path.stat(), self.generation)
+        os.replace(tmp_path, self.index_file_path)
+
+    @staticmethod
+    def write_index_file(
+        path: Path, hash: MutableMapping[str, tuple[int, int, int]], db_file_stat: os.stat_result, generation: int
+    ):
+        with path.open('wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, db_file_stat.st_size, db_file_stat.st_mtime_ns, generation))
+            for key, value in hash.items():
+                key_in_bytes = key.encode()
+                f.write(INDEX_ENTRY.pack(1, *value, len(key_in_bytes)))
+                f.write(key_in_bytes)
+
+    def append_to_index(self, status: int, key: str, value: tuple[int, int, int]):
+        self.append_entries_to_index([(status, key, value)])
+
+    def append_entries_to_index(self, entries: list[tuple[int, str, tuple[int, int, int]]]):
+        if not self.db_file or not self.index_file:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before indexing!')
+
+        # the header has to describe the db-file after the change
+        self.db_file.flush()
+        db_file_stat = os.fstat(self.db_file.fileno())
+        self.generation += 1
+
+        self.index_file.seek(0, 2)
+        for status, key, value in entries:
+            key_in_bytes = key.encode()
+            self.index_file.write(INDEX_ENTRY.pack(status, *value, len(key_in_bytes)))
+            self.index_file.write(key_in_bytes)
+        self.index_file.seek(0)
+        self.index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, db_file_stat.st_size, db_file_stat.st_mtime_ns, self.generation))
+        self.index_file.flush()
+
+    def scan(self):
+        """Rebuilds the hash by walking through all records of the db-file"""
+        log.info('KeyValueDB: scanning %s...', self.db_file_path.as_posix())
+        self.hash = {}
         with self.db_file_path.open('rb') as dbf:
             cursor = 0
             dbf.seek(0, 2)
@@ -75,20 +316,221 @@ class KeyValueDB:
             if total_size_of_deleted_files > 0:
                 log.info('KeyValueDB: %s bytes may be deleted by compression', total_size_of_deleted_files)
 
-        self.db_file = self.db_file_path.open('r+b')
+        self.set_hash(self.hash)
+
+    def set_hash(self, hash: MutableMapping[str, tuple[int, int, int]]):
+        self.hash, self.normalized = self.build_hash(hash, self.db_file_path.stat())
+
+    def build_hash(
+        self, hash: MutableMapping[str, tuple[int, int, int]], db_file_stat: os.stat_result
+    ) -> tuple[MutableMapping[str, tuple[int, int, int]], NormalizedIndex | None]:
+        """The hash in the configured form (dict, CompactIndex or mapped CompactIndex) and its normalized index.
+        A CompactIndex keeps the normalized keys in its sorted part, with a dict they are kept in a dict."""
+        normalized = self.normalized is not None
+        if self.shared_index:
+            CompactIndex(hash.items(), normalized=normalized).store(
+                self.shared_index_path, db_file_stat.st_size, db_file_stat.st_mtime_ns
+            )
+            mapped_hash = CompactIndex.load_mapped(
+                self.shared_index_path, db_file_stat.st_size, db_file_stat.st_mtime_ns, normalized=normalized
+            )
+            hash = mapped_hash if mapped_hash is not None else CompactIndex(hash.items(), normalized=normalized)
+        elif self.compact_index:
+            hash = CompactIndex(hash.items(), normalized=normalized)
+
+        if not normalized:
+            return hash, None
+        return hash, NormalizedIndex(base=hash) if isinstance(hash, CompactIndex) else NormalizedIndex(hash)
+
+    @contextlib.contextmanager
+    def changing_hash(self):
+        """Marks a change of the hash for the readers without the lock, the caller holds the lock"""
+        self.version += 1
+        try:
+            yield
+        finally:
+            self.version += 1
+
+    def record_change(self, status: int, key: str, value: tuple[int, int, int]):
+        if self.changes is not None:
+            self.changes.append((status, key, value))
+
+    def remap(self):
+        """Maps the whole db-file into memory, the mapping has to be renewed after the file has grown.
+
+        The previous mapping is not closed explicitly: memoryviews returned by read() may still be in use,
+        it is released by gc as soon as the last view is gone.
+        """
+        if not self.db_file:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before mapping!')
+
+        self.db_file.flush()
         self.db_file.seek(0, 2)
-        log.info('DB file size: %s bytes, %s Mb', self.db_file.tell(), self.db_file.tell() / 1024 / 1024)
+        # an empty file can not be mapped
+        self.mm = mmap.mmap(self.db_file.fileno(), 0, access=mmap.ACCESS_READ) if self.db_file.tell() > 0 else None
+
+    def size(self) -> int:
+        """Size of the db-file in bytes"""
+        if not self.db_file:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before reading!')
+
+        with self.lock:
+            self.db_file.flush()
+            return os.fstat(self.db_file.fileno()).st_size
+
+    def live_size(self) -> int:
+        """Size of the records that are not marked as deleted"""
+        with self.lock:
+            return sum(value_pos + value_len - record_pos for record_pos, value_pos, value_len in self.hash.values())
+
+    def find(self, key: str) -> str | None:
+        """Returns the key itself if it exists, otherwise a key with the same normalized form (Strasse -> Straße)"""
+        if self.has(key):
+            return key
+        return self.normalized.find(key) if self.normalized else None
+
+    def records(self) -> list[tuple[str, tuple[int, int, int]]]:
+        """Snapshot of the hash, a CompactIndex is read by position without a lookup per key and without the lock"""
+        with self.lock:
+            snapshot = self.hash_snapshot()
+        return list(snapshot.iter_items() if isinstance(snapshot, CompactIndex) else snapshot.items())
+
+    def hash_snapshot(self) -> MutableMapping[str, tuple[int, int, int]]:
+        """A copy of the hash that is not affected by later changes, the caller holds the lock"""
+        return self.hash.snapshot() if isinstance(self.hash, CompactIndex) else dict(self.hash)
+
+    def keys_with_prefix(self, prefix: str, limit: int = 10) -> list[str]:
+        """Sorted keys that start with prefix. Binary search with compact_index, a scan of all keys otherwise."""
+        with self.lock:
+            if isinstance(self.hash, CompactIndex):
+                return self.hash.keys_with_prefix(prefix, limit)
+            return sorted(k for k in self.hash if k.startswith(prefix))[:limit]
 
     def has(self, key: str):
         if not self.db_file:
             raise InvalidDBOperationError(details='KeyValueDB should be connected before writing!')
         return self.hash.get(key) != None
 
+    def etag(self, key: str) -> str | None:
+        """Strong validator of the value: a record is never changed in place,
+        its position changes only if the record is rewritten or moved to a new db-file by compaction.
+
+        It is called in the event loop, so the hash is read without the lock. The result is used only if no change
+        of the hash (a write, a fold of the CompactIndex, the swap of a compaction) has overlapped with the reading.
+        """
+        if not self.db_file:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before reading!')
+
+        version = self.version
+        if version % 2 == 0:
+            try:
+                value, file_id = self.hash.get(key), self.file_id
+            except (IndexError, ValueError):
+                # the sorted part of the CompactIndex has been replaced while reading
+                value, file_id, version = None, 0, -1
+            if self.version == version:
+                return f'"{file_id:x}-{value[1]:x}-{value[2]:x}"' if value else None
+
+        with self.lock:
+            value = self.hash.get(key)
+            return f'"{self.file_id:x}-{value[1]:x}-{value[2]:x}"' if value else None
+
     def write(self, key: str, bb: bytes):
         if not self.db_file:
             raise InvalidDBOperationError(details='KeyValueDB should be connected before writing!')
 
         value_size = len(bb)
+        self.validate_size(key, value_size)
+
+        if self.hash.get(key):
+            # raise InvalidDBOperationError(f'Key {key} is a duplicate. File can not be written.')
+            log.info('KeyValueDB.write. Value with key: %s allready exists.', key)
+            return
+
+        with self.lock:
+            key_in_bytes = key.encode()
+            file_status = 1
+            self.db_file.seek(0, 2)  # move seek pointer to the end
+            cursor_before = self.db_file.tell()
+            # do not forget: write method changes cursor (seek position)
+            self.db_file.write(file_status.to_bytes(META_DATA_SIZE, 'little'))
+            self.db_file.write(len(key_in_bytes).to_bytes(INT_SIZE, 'little'))
+            self.db_file.write(key_in_bytes)
+            self.db_file.write(value_size.to_bytes(INT_SIZE, 'little'))
+            self.db_file.write(bb)
+            cursor_after = self.db_file.tell()
+
+            value = (cursor_before, cursor_after - value_size, value_size)
+            with self.changing_hash():
+                self.hash[key] = value
+            if self.normalized:
+                self.normalized.add(key)
+            self.record_change(file_status, key, value)
+            self.append_to_index(file_status, key, value)
+
+    def write_many(self, items: Iterable[tuple[str, bytes]]) -> int:
+        """Appends all records with vectored writes and one fsync, returns the number of written records.
+        Keys that already exist are skipped, like in write()."""
+        if not self.db_file:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before writing!')
+
+        with self.lock:
+            self.db_file.flush()
+            fd = self.db_file.fileno()
+            cursor = os.fstat(fd).st_size
+            buffers: list[bytes] = []
+            new_records: dict[str, tuple[int, int, int]] = {}
+            for key, bb in items:
+                value_size = len(bb)
+                self.validate_size(key, value_size)
+                if self.hash.get(key) or key in new_records:
+                    log.info('KeyValueDB.write_many. Value with key: %s allready exists.', key)
+                    continue
+
+                key_in_bytes = key.encode()
+                header = RECORD_HEADER.pack(1, len(key_in_bytes)) + key_in_bytes + value_size.to_bytes(INT_SIZE, 'little')
+                buffers.append(header)
+                buffers.append(bb)
+                new_records[key] = (cursor, cursor + len(header), value_size)
+                cursor += len(header) + value_size
+
+            if not new_records:
+                return 0
+
+            offset = next(iter(new_records.values()))[0]
+            for i in range(0, len(buffers), IOV_MAX):
+                offset = self.pwritev_all(fd, buffers[i : i + IOV_MAX], offset)
+            os.fsync(fd)
+
+            with self.changing_hash():
+                if isinstance(self.hash, CompactIndex):
+                    self.hash.update_many(new_records)
+                else:
+                    self.hash.update(new_records)
+            if self.normalized:
+                for key in new_records:
+                    self.normalized.add(key)
+            for key, value in new_records.items():
+                self.record_change(1, key, value)
+            self.append_entries_to_index([(1, key, value) for key, value in new_records.items()])
+            return len(new_records)
+
+    @staticmethod
+    def pwritev_all(fd: int, buffers: list[bytes], offset: int) -> int:
+        """Writes the buffers at offset, os.pwritev may write only a part of them"""
+        views = [memoryview(b) for b in buffers]
+        i = 0
+        while i < len(views):
+            written = os.pwritev(fd, views[i:], offset)
+            offset += written
+            while i < len(views) and written >= len(views[i]):
+                written -= len(views[i])
+                i += 1
+            if written > 0:
+                views[i] = views[i][written:]
+        return offset
+
+    def validate_size(self, key: str, value_size: int):
         if value_size == 0:
             msg = f'File <{key}> can not be empty'
             raise InvalidFileSizeError(msg)
@@ -97,53 +539,249 @@ class KeyValueDB:
             msg = f'Size of <{key}>: {value_size} > maximum of unsigned integer ({self.max_bytes_len})'
             raise InvalidFileSizeError(msg)
 
-        if self.hash.get(key):
-            # raise InvalidDBOperationError(f'Key {key} is a duplicate. File can not be written.')
-            log.info('KeyValueDB.write. Value with key: %s allready exists.', key)
-            return
+    def read(self, key: str) -> bytes | memoryview | None:
+        if self.cache and not self.use_mmap:
+            bb = self.cache.get(key)
+            if bb is not None:
+                return bb
+        return self.read_file(key)
 
-        key_in_bytes = key.encode()
-        file_status = 1
-        self.db_file.seek(0, 2)  # move seek pointer to the end
-        cursor_before = self.db_file.tell()
-        # do not forget: write method changes cursor (seek position)
-        self.db_file.write(file_status.to_bytes(META_DATA_SIZE, 'little'))
-        self.db_file.write(len(key_in_bytes).to_bytes(INT_SIZE, 'little'))
-        self.db_file.write(key_in_bytes)
-        self.db_file.write(value_size.to_bytes(INT_SIZE, 'little'))
-        self.db_file.write(bb)
-        cursor_after = self.db_file.tell()
-
-        self.hash[key] = (cursor_before, cursor_after - value_size, value_size)
-
-    def read(self, key: str) -> bytes | None:
+    def read_file(self, key: str) -> bytes | memoryview | None:
         if not self.db_file:
             raise InvalidDBOperationError(details='KeyValueDB should be connected before reading!')
 
-        value = self.hash.get(key)
-        if value:
-            self.db_file.seek(value[1])
-            return self.db_file.read(value[2])
-        else:
-            return None
+        with self.lock:
+            value = self.hash.get(key)
+            if not value:
+                return None
+
+            if self.use_mmap:
+                end = value[1] + value[2]
+                if not self.mm or len(self.mm) < end:
+                    # the value has been written after the last mapping
+                    self.remap()
+                return memoryview(self.mm)[value[1] : end]  # type: ignore[index]
+
+            fd = self.db_file.fileno()
+
+        bb = os.pread(fd, value[2], value[1])
+        if self.cache:
+            with self.lock:
+                # the key may have been removed while reading, a removed value must not get into the cache
+                if self.hash.get(key) == value:
+                    self.cache.put(key, bb)
+        return bb
+
+    async def read_async(self, key: str) -> bytes | memoryview | None:
+        if not self.executor:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before reading!')
+
+        if self.cache and not self.use_mmap:
+            # hot values are returned without a hop to the thread pool
+            bb = self.cache.get(key)
+            if bb is not None:
+                return bb
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.read_file, key)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.read_resident, key)
+
+    def read_resident(self, key: str) -> bytes | memoryview | None:
+        bb = self.read(key)
+        if isinstance(bb, memoryview):
+            # touch every page of the mapped value, so the page faults happen in this thread
+            # and not later in the event loop while the response is being sent
+            bb[:: mmap.PAGESIZE].tobytes()
+        return bb
 
     def remove(self, key: str) -> bool:
         if not self.db_file:
             raise InvalidDBOperationError(details='KeyValueDB should be connected before removing!')
 
-        value = self.hash.get(key)
-        if value:
-            delete_status = 0
-            self.db_file.seek(value[0])
-            self.db_file.write(delete_status.to_bytes(META_DATA_SIZE, 'little'))
-            del self.hash[key]
-            return True
-        else:
-            return False
+        with self.lock:
+            value = self.hash.get(key)
+            if value:
+                delete_status = 0
+                self.db_file.seek(value[0])
+                self.db_file.write(delete_status.to_bytes(META_DATA_SIZE, 'little'))
+                with self.changing_hash():
+                    del self.hash[key]
+                if self.normalized:
+                    self.normalized.remove(key)
+                if self.cache:
+                    self.cache.remove(key)
+                self.record_change(delete_status, key, value)
+                self.append_to_index(delete_status, key, value)
+                return True
+            else:
+                return False
+
+    def compact(self) -> CompactionReport:
+        """Rewrites the live records into a new db-file and swaps it with the current one.
+
+        Records are copied without holding the lock, so reads and writes are served meanwhile. Records written
+        and removed during the copying are taken from self.changes and copied after them, until only a few are left.
+        The new hash, its normalized index and the index-file are built without the lock too,
+        under the lock the last changes are applied and the references are swapped.
+
+        Only this process switches to the new db-file. Other processes connected to the same db-file (uvicorn workers)
+        keep reading the replaced one: its space is reclaimed and their ETags change only after they reconnect.
+        """
+        if not self.db_file:
+            raise InvalidDBOperationError(details='KeyValueDB should be connected before compaction!')
+
+        started_at = time.perf_counter()
+        # every process writes its own files, the last replace wins
+        compacted_file_path = self.db_file_path.with_name(f'{self.db_file_path.name}.{os.getpid()}.compacting')
+        compacted_index_path = self.index_file_path.with_name(f'{self.index_file_path.name}.{os.getpid()}.compacting')
+        log.info('KeyValueDB: compaction of %s...', self.db_file_path.as_posix())
+
+        with self.lock:
+            if self.changes is not None:
+                raise InvalidDBOperationError(details='KeyValueDB is being compacted already!')
+            self.db_file.flush()
+            snapshot = self.hash_snapshot()
+            self.changes = []
+
+        try:
+            records = snapshot.iter_items() if isinstance(snapshot, CompactIndex) else snapshot.items()
+            new_hash: dict[str, tuple[int, int, int]] = {}
+            with self.db_file_path.open('rb') as src, compacted_file_path.open('w+b') as dst:
+                self.copy_records(src, dst, records, new_hash)
+                while True:
+                    with self.lock:
+                        if len(self.changes) <= COMPACTION_SWAP_CHANGES:
+                            break
+                        self.db_file.flush()
+                        changes, self.changes = self.changes, []
+                    self.apply_changes(src, dst, changes, new_hash)
+                dst.flush()
+                os.fsync(dst.fileno())
+
+                hash, normalized = self.build_hash(new_hash, os.fstat(dst.fileno()))
+                generation = self.generation + 1
+                self.write_index_file(compacted_index_path, hash, os.fstat(dst.fileno()), generation)
+
+                with self.lock:
+                    self.db_file.flush()
+                    changes, self.changes = self.changes, None
+                    # the last changes are applied to the new hash, the new index-file gets them appended after the swap
+                    entries = self.apply_changes(src, dst, changes, hash, normalized)
+                    if entries:
+                        dst.flush()
+                        os.fsync(dst.fileno())
+
+                    size_before = os.fstat(self.db_file.fileno()).st_size
+                    size_after = dst.seek(0, 2)
+                    os.replace(compacted_file_path, self.db_file_path)
+                    os.replace(compacted_index_path, self.index_file_path)
+
+                    old_db_file, old_mm = self.db_file, self.mm
+                    with self.changing_hash():
+                        self.db_file = self.db_file_path.open('r+b')
+                        self.file_id = os.fstat(self.db_file.fileno()).st_ino
+                        self.hash = hash
+                        self.normalized = normalized
+                        self.generation = generation
+                    self.mm = None
+                    if self.use_mmap:
+                        self.remap()
+                    # the index-file was replaced, reopen it for appending
+                    if self.index_file:
+                        self.index_file.close()
+                    self.index_file = self.index_file_path.open('r+b')
+                    if entries:
+                        self.append_entries_to_index(entries)
+
+                    self.retired_files.append(old_db_file)
+                    if old_mm:
+                        try:
+                            old_mm.close()
+                        except BufferError:
+                            pass
+        finally:
+            with self.lock:
+                self.changes = None
+            compacted_file_path.unlink(missing_ok=True)
+            compacted_index_path.unlink(missing_ok=True)
+
+        report = CompactionReport(
+            db_path=self.db_file_path.as_posix(),
+            size_before=size_before,
+            size_after=size_after,
+            reclaimed_bytes=size_before - size_after,
+            keys=len(hash),
+            duration_sec=round(time.perf_counter() - started_at, 3),
+        )
+        log.info('KeyValueDB: compaction is completed: %s', report)
+        return report
+
+    @classmethod
+    def apply_changes(
+        cls,
+        src,
+        dst,
+        changes: list[tuple[int, str, tuple[int, int, int]]],
+        new_hash: MutableMapping[str, tuple[int, int, int]],
+        normalized: NormalizedIndex | None = None,
+    ) -> list[tuple[int, str, tuple[int, int, int]]]:
+        """Repeats the changes made during the copying in the compacted file, returns its index entries"""
+        entries = []
+        for status, key, value in changes:
+            if status == 1:
+                copied: dict[str, tuple[int, int, int]] = {}
+                cls.copy_records(src, dst, [(key, value)], copied)
+                new_hash[key] = copied[key]
+                if normalized:
+                    normalized.add(key)
+                entries.append((status, key, copied[key]))
+            elif key in new_hash:
+                copied_value = new_hash.pop(key)
+                delete_status = 0
+                dst.seek(copied_value[0])
+                dst.write(delete_status.to_bytes(META_DATA_SIZE, 'little'))
+                dst.seek(0, 2)
+                if normalized:
+                    normalized.remove(key)
+                entries.append((status, key, copied_value))
+        return entries
+
+    @staticmethod
+    def copy_records(src, dst, records, new_hash: dict[str, tuple[int, int, int]]):
+        for key, (record_pos, value_pos, value_len) in sorted(records, key=lambda r: r[1][0]):
+            new_record_pos = dst.tell()
+            src.seek(record_pos)
+            remaining = value_pos + value_len - record_pos
+            while remaining > 0:
+                chunk = src.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    raise InvalidDBFileError(src.name, f'Unexpected end of file, record of <{key}> is truncated.')
+                dst.write(chunk)
+                remaining -= len(chunk)
+            new_hash[key] = (new_record_pos, new_record_pos + value_pos - record_pos, value_len)
 
     def close(self):
-        if self.db_file:
-            self.db_file.close()
+        with self.lock:
+            if self.mm:
+                try:
+                    self.mm.close()
+                except BufferError:
+                    # some memoryviews are still exported, the mapping is released by gc
+                    pass
+                self.mm = None
+            if self.db_file:
+                self.db_file.close()
+                self.db_file = None
+            if self.index_file:
+                self.index_file.close()
+                self.index_file = None
+            for f in self.retired_files:
+                f.close()
+            self.retired_files = []
+            if self.cache:
+                self.cache.clear()
+            if self.executor:
+                self.executor.shutdown(wait=False)
+                self.executor = None
 
 
 class KeyValueDBError(Exception):
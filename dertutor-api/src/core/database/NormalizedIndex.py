@@ -0,0 +1,67 @@
+import functools
+import re
+import unicodedata
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .CompactIndex import CompactIndex
+
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue'})
+# precomposed latin letters with accents: Latin-1 Supplement, Latin Extended-A/B, Latin Extended Additional
+ACCENTED_LATIN = re.compile('[\u00c0-\u024f\u1e00-\u1eff]')
+
+
+@functools.cache
+def latin_base(letter: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', letter) if not unicodedata.combining(c))
+
+
+def strip_latin_accents(text: str) -> str:
+    """Café -> Cafe. Marks of other scripts are parts of letters of their own (й, ё in russian), they are kept"""
+    # NFKC composes the letters, then only the latin ones are replaced, a few distinct ones per text
+    text = unicodedata.normalize('NFKC', text)
+    for letter in set(ACCENTED_LATIN.findall(text)):
+        text = text.replace(letter, latin_base(letter))
+    return text
+
+
+def normalize_key(key: str) -> str:
+    """Straße -> strasse, Häuser -> haeuser, Café -> cafe, Ёлка -> ёлка"""
+    # casefold turns ß into ss
+    return strip_latin_accents(key.strip().casefold().translate(UMLAUTS))
+
+
+class NormalizedIndex:
+    """Secondary index: normalized key -> original keys.
+
+    If base is a CompactIndex with normalized keys, the keys of its sorted part are found there
+    (in a mapped shared index they are not copied into every process), the dict holds only keys added later.
+    """
+
+    def __init__(self, keys: Iterable[str] = (), base: 'CompactIndex | None' = None) -> None:
+        self.hash: dict[str, list[str]] = {}
+        self.base = base
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str):
+        keys = self.hash.setdefault(normalize_key(key), [])
+        if key not in keys:
+            keys.append(key)
+
+    def remove(self, key: str):
+        normalized_key = normalize_key(key)
+        keys = self.hash.get(normalized_key)
+        if keys and key in keys:
+            keys.remove(key)
+            if not keys:
+                del self.hash[normalized_key]
+
+    def find(self, key: str) -> str | None:
+        """Returns the first original key with the same normalized form"""
+        normalized_key = normalize_key(key)
+        keys = self.hash.get(normalized_key)
+        if keys:
+            return keys[0]
+        return self.base.find_normalized(normalized_key) if self.base is not None else None
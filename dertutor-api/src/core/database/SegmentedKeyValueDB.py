@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .KeyValueDB import INT_SIZE, META_DATA_SIZE, CompactionReport, InvalidDBOperationError, KeyValueDB
+from .ValueCache import ValueCache
+
+log = logging.getLogger('uvicorn')
+
+MANIFEST_VERSION = 1
+
+
+class SegmentedKeyValueDB:
+    """DB Scheme (a directory):
+
+    manifest.json   {"version": 1, "max_segment_size": ..., "segments": ["segment_000001.bin", ...]}
+    segment_000001.bin, segment_000001.bin.idx
+    segment_000002.bin, segment_000002.bin.idx
+    ...
+
+    Every segment is a KeyValueDB with its own index. Values are appended to the last (active) segment only,
+    when it would outgrow max_segment_size, it is sealed and a new segment becomes active.
+    Sealed segments are never appended to, so they are always read through mmap;
+    remove() only marks a record as deleted in its segment, compact() rewrites the segments one by one.
+
+    A key is unique across all segments, so all segments share one cache (see KeyValueDB).
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        max_segment_size: int = 256 * 1024 * 1024,
+        use_mmap: bool = False,
+        compact_index: bool = False,
+        read_workers: int = 8,
+        normalized_index: bool = False,
+        shared_index: bool = False,
+        cache: ValueCache | None = None,
+    ) -> None:
+        log.info('new SegmentedKeyValueDB: %s', db_path)
+        self.db_path = db_path
+        self.manifest_path = db_path / 'manifest.json'
+        self.max_segment_size = max_segment_size
+        self.use_mmap = use_mmap
+        self.compact_index = compact_index
+        self.normalized_index = normalized_index
+        self.shared_index = shared_index
+        self.cache = cache
+        self.read_workers = read_workers
+        self.segments: list[KeyValueDB] = []
+        self.executor: ThreadPoolExecutor | None = None
+        # guards the list of segments against rotation
+        self.lock = threading.RLock()
+
+    @property
+    def active_segment(self) -> KeyValueDB:
+        if not self.segments:
+            raise InvalidDBOperationError(details='SegmentedKeyValueDB should be connected before using!')
+        return self.segments[-1]
+
+    def connect(self):
+        if self.segments:
+            return
+
+        self.db_path.mkdir(parents=True, exist_ok=True)
+        if self.manifest_path.exists():
+            manifest = json.loads(self.manifest_path.read_text())
+            if manifest.get('version') != MANIFEST_VERSION:
+                raise InvalidDBOperationError(details=f'Unsupported manifest version: {manifest.get("version")}')
+            segment_names = manifest['segments']
+        else:
+            segment_names = [self.segment_name(1)]
+
+        log.info('Connecting to: %s, segments: %s...', self.db_path.as_posix(), len(segment_names))
+        for i, name in enumerate(segment_names):
+            is_sealed = i < len(segment_names) - 1
+            self.segments.append(self.open_segment(name, use_mmap=self.use_mmap or is_sealed))
+        self.store_manifest()
+        self.executor = ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix='SegmentedKeyValueDB')
+
+    @staticmethod
+    def segment_name(number: int) -> str:
+        return f'segment_{number:06d}.bin'
+
+    def open_segment(self, name: str, use_mmap: bool) -> KeyValueDB:
+        # reading is done by the common executor, a segment does not need its own threads
+        segment = KeyValueDB(
+            self.db_path / name,
+            use_mmap=use_mmap,
+            compact_index=self.compact_index,
+            read_workers=1,
+            normalized_index=self.normalized_index,
+            shared_index=self.shared_index,
+            cache=self.cache,
+        )
+        segment.connect()
+        return segment
+
+    def store_manifest(self):
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'max_segment_size': self.max_segment_size,
+            'segments': [s.db_file_path.name for s in self.segments],
+        }
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, self.manifest_path)
+
+    def rotate(self):
+        """Seals the active segment and starts a new one"""
+        sealed = self.active_segment
+        if not sealed.use_mmap:
+            sealed.use_mmap = True
+            sealed.remap()
+
+        number = int(sealed.db_file_path.stem.removeprefix('segment_')) + 1
+        self.segments.append(self.open_segment(self.segment_name(number), use_mmap=self.use_mmap))
+        self.store_manifest()
+        log.info('SegmentedKeyValueDB: %s is sealed, %s is active', sealed.db_file_path.name, self.segment_name(number))
+
+    def segment_of(self, key: str) -> KeyValueDB | None:
+        for segment in reversed(self.segments):
+            if segment.has(key):
+                return segment
+        return None
+
+    def find(self, key: str) -> str | None:
+        if self.has(key):
+            return key
+        for segment in reversed(self.segments):
+            found_key = segment.find(key)
+            if found_key:
+                return found_key
+        return None
+
+    def has(self, key: str) -> bool:
+        return self.segment_of(key) is not None
+
+    def etag(self, key: str) -> str | None:
+        segment = self.segment_of(key)
+        return segment.etag(key) if segment else None
+
+    def read(self, key: str) -> bytes | memoryview | None:
+        segment = self.segment_of(key)
+        return segment.read(key) if segment else None
+
+    def read_resident(self, key: str) -> bytes | memoryview | None:
+        segment = self.segment_of(key)
+        return segment.read_resident(key) if segment else None
+
+    async def read_async(self, key: str) -> bytes | memoryview | None:
+        if not self.executor:
+            raise InvalidDBOperationError(details='SegmentedKeyValueDB should be connected before reading!')
+
+        if self.cache and not self.use_mmap:
+            # hot values are returned without a hop to the thread pool, like in KeyValueDB.read_async()
+            bb = self.cache.get(key)
+            if bb is not None:
+                return bb
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.read_resident, key)
+
+    def write(self, key: str, bb: bytes):
+        with self.lock:
+            if self.has(key):
+                log.info('SegmentedKeyValueDB.write. Value with key: %s allready exists.', key)
+                return
+
+            active = self.active_segment
+            record_size = META_DATA_SIZE + INT_SIZE + len(key.encode()) + INT_SIZE + len(bb)
+            if active.size() > 0 and active.size() + record_size > self.max_segment_size:
+                self.rotate()
+            self.active_segment.write(key, bb)
+
+    def write_many(self, items: Iterable[tuple[str, bytes]]) -> int:
+        """Splits the records into batches that fit into the segments, every batch is written by one write_many()"""
+        with self.lock:
+            written = 0
+            batch: list[tuple[str, bytes]] = []
+            active_size = self.active_segment.size()
+            for key, bb in items:
+                if self.has(key):
+                    log.info('SegmentedKeyValueDB.write_many. Value with key: %s allready exists.', key)
+                    continue
+
+                record_size = META_DATA_SIZE + INT_SIZE + len(key.encode()) + INT_SIZE + len(bb)
+                if active_size > 0 and active_size + record_size > self.max_segment_size:
+                    written += self.active_segment.write_many(batch)
+                    batch = []
+                    self.rotate()
+                    active_size = 0
+                batch.append((key, bb))
+                active_size += record_size
+
+            written += self.active_segment.write_many(batch)
+            return written
+
+    def remove(self, key: str) -> bool:
+        with self.lock:
+            segment = self.segment_of(key)
+            return segment.remove(key) if segment else False
+
+    def compact(self) -> CompactionReport:
+        """Compacts the segments with deleted records one after another, only one segment is rewritten at a time"""
+        started_at = time.perf_counter()
+        segments = list(self.segments)
+        untouched = [s for s in segments if s.live_size() == s.size()]
+        reports = [s.compact() for s in segments if s not in untouched]
+        return CompactionReport(
+            db_path=self.db_path.as_posix(),
+            size_before=sum(r.size_before for r in reports) + sum(s.size() for s in untouched),
+            size_after=sum(r.size_after for r in reports) + sum(s.size() for s in untouched),
+            reclaimed_bytes=sum(r.reclaimed_bytes for r in reports),
+            keys=sum(len(s.hash) for s in self.segments),
+            duration_sec=round(time.perf_counter() - started_at, 3),
+        )
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+            if self.executor:
+                self.executor.shutdown(wait=False)
+                self.executor = None
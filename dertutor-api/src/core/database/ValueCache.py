@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class CacheStats:
+    max_size: int
+    size: int
+    items: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+
+
+class ValueCache:
+    """Thread-safe LRU cache of values with a budget in bytes.
+
+    The least recently used values are evicted when the total size of the values exceeds max_size.
+    Values larger than max_item_size are not cached, so one big file can not flush the whole cache.
+    One cache can be shared by several dbs if their keys do not intersect (segments of SegmentedKeyValueDB).
+    """
+
+    def __init__(self, max_size: int, max_item_size: int | None = None) -> None:
+        self.max_size = max_size
+        self.max_item_size = max_item_size if max_item_size is not None else max_size // 16
+        self.values: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            bb = self.values.get(key)
+            if bb is None:
+                self.misses += 1
+                return None
+            self.values.move_to_end(key)
+            self.hits += 1
+            return bb
+
+    def put(self, key: str, bb: bytes):
+        if len(bb) > self.max_item_size:
+            return
+
+        with self.lock:
+            old = self.values.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.values[key] = bb
+            self.size += len(bb)
+            while self.size > self.max_size:
+                _, evicted = self.values.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def remove(self, key: str):
+        with self.lock:
+            bb = self.values.pop(key, None)
+            if bb is not None:
+                self.size -= len(bb)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.size = 0
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            requests = self.hits + self.misses
+            return CacheStats(
+                max_size=self.max_size,
+                size=self.size,
+                items=len(self.values),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=round(self.hits / requests, 4) if requests else 0.0,
+            )
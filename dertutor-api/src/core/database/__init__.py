@@ -1,3 +1,7 @@
-__all__ = ('InvalidDBFileError', 'InvalidDBOperationError', 'InvalidFileSizeError', 'JsonFileDB', 'KeyValueDB', 'KeyValueDBError')
+__all__ = ('CacheStats', 'CompactIndex', 'CompactionReport', 'InvalidDBFileError', 'InvalidDBOperationError', 'InvalidFileSizeError', 'InvertedIndex', 'JsonFileDB', 'KeyValueDB', 'KeyValueDBError', 'SegmentedKeyValueDB', 'ValueCache')
+from .CompactIndex import CompactIndex
+from .InvertedIndex import InvertedIndex
 from .JsonFileDB import JsonFileDB
-from .KeyValueDB import InvalidDBFileError, InvalidDBOperationError, InvalidFileSizeError, KeyValueDB, KeyValueDBError
+from .KeyValueDB import CompactionReport, InvalidDBFileError, InvalidDBOperationError, InvalidFileSizeError, KeyValueDB, KeyValueDBError
+from .SegmentedKeyValueDB import SegmentedKeyValueDB
+from .ValueCache import CacheStats, ValueCache
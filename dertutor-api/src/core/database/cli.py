@@ -0,0 +1,294 @@
+"""Maintenance commands for the corpus databases.
+
+Run from the dertutor-api folder while the API is stopped
+(the running API has to use POST /api/corpus/{db_name}/compact instead), e.g.::
+
+    uv run python -m src.core.database.cli compact data/pron/de_pron.bin
+    uv run python -m src.core.database.cli segment data/pron/de_pron.bin data/pron/de_pron
+    uv run python -m src.core.database.cli ingest data/pron/de_pron.bin ~/de_mp3/
+
+"""
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import random
+import resource
+import tarfile
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from src.core.database.KeyValueDB import KeyValueDB
+from src.core.database.SegmentedKeyValueDB import SegmentedKeyValueDB
+
+log = logging.getLogger('uvicorn')
+
+
+def open_db(db_path: Path) -> KeyValueDB | SegmentedKeyValueDB:
+    db = SegmentedKeyValueDB(db_path=db_path) if db_path.is_dir() else KeyValueDB(db_path=db_path)
+    db.connect()
+    return db
+
+
+def compact(args: argparse.Namespace):
+    for db_path in args.db_paths:
+        db = open_db(Path(db_path))
+        try:
+            report = db.compact()
+        finally:
+            db.close()
+        print(
+            f'{report.db_path}: {report.size_before} -> {report.size_after} bytes, '
+            f'reclaimed {report.reclaimed_bytes} bytes ({report.reclaimed_bytes / 1024 / 1024:.2f} Mb), '
+            f'{report.keys} keys, {report.duration_sec} sec'
+        )
+
+
+def segment(args: argparse.Namespace):
+    src = KeyValueDB(db_path=Path(args.src_path), use_mmap=True)
+    src.connect()
+    dst = SegmentedKeyValueDB(db_path=Path(args.dst_path), max_segment_size=args.max_segment_mb * 1024 * 1024)
+    dst.connect()
+    batch_size_limit = args.batch_mb * 1024 * 1024
+    try:
+        batch: list[tuple[str, bytes]] = []
+        batch_size = 0
+        # keep the order of the records
+        for key, _ in sorted(src.hash.items(), key=lambda item: item[1][0]):
+            bb = src.read(key)
+            if bb is None:
+                continue
+            # a copy, the mapping of src can not be closed while a memoryview of it is alive
+            batch.append((key, bytes(bb)))
+            batch_size += len(bb)
+            if batch_size >= batch_size_limit:
+                dst.write_many(batch)
+                batch, batch_size = [], 0
+        dst.write_many(batch)
+        print(f'{len(src.hash)} records are copied into {len(dst.segments)} segments of {args.dst_path}')
+    finally:
+        src.close()
+        dst.close()
+
+
+def read_dir(src_path: Path, suffix: str, workers: int) -> Iterator[tuple[str, bytes]]:
+    paths = sorted(p for p in src_path.rglob('*' + suffix) if p.is_file())
+    chunk_size = workers * 64
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # files are read in chunks, so memory does not grow if reading outpaces writing
+        for i in range(0, len(paths), chunk_size):
+            chunk = paths[i : i + chunk_size]
+            yield from zip((p.stem for p in chunk), executor.map(Path.read_bytes, chunk))
+
+
+def read_tar(src_path: Path, suffix: str) -> Iterator[tuple[str, bytes]]:
+    # a (compressed) tar is a single stream, its members can be read only one after another
+    with tarfile.open(src_path) as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(suffix):
+                f = tar.extractfile(member)
+                if f:
+                    yield Path(member.name).stem, f.read()
+
+
+def ingest(args: argparse.Namespace):
+    src_path = Path(args.src_path)
+    items = read_dir(src_path, args.suffix, args.workers) if src_path.is_dir() else read_tar(src_path, args.suffix)
+    db = open_db(Path(args.db_path))
+
+    batch_size_limit = args.batch_mb * 1024 * 1024
+    files = written = total_bytes = 0
+    started_at = time.perf_counter()
+    try:
+        batch: list[tuple[str, bytes]] = []
+        batch_size = 0
+        for key, bb in items:
+            batch.append((key, bb))
+            batch_size += len(bb)
+            files += 1
+            total_bytes += len(bb)
+            if batch_size >= batch_size_limit:
+                written += db.write_many(batch)
+                batch, batch_size = [], 0
+        written += db.write_many(batch)
+    finally:
+        db.close()
+
+    duration_sec = time.perf_counter() - started_at
+    mb = total_bytes / 1024 / 1024
+    print(
+        f'{files} files ({mb:.2f} Mb) are read, {written} are written, {files - written} skipped, '
+        f'{duration_sec:.2f} sec: {files / duration_sec:.0f} files/s, {mb / duration_sec:.2f} Mb/s'
+    )
+
+
+def rss_bytes() -> int:
+    """Current resident set size of the process, peak RSS if /proc is not available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def pss_bytes() -> int:
+    """Proportional set size: shared pages are divided between the processes that map them"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return rss_bytes()
+
+
+def run_worker(db_path: str, mode: str, normalized: bool, keys: list[str], barrier, results):
+    rss_before = rss_bytes()
+    db = KeyValueDB(
+        db_path=Path(db_path),
+        compact_index=mode != 'dict',
+        shared_index=mode == 'shared',
+        normalized_index=normalized,
+    )
+    db.connect()
+    for k in keys:
+        db.has(k)
+        if normalized:
+            db.find(k.upper())
+    gc.collect()
+    # all workers are alive while measuring, otherwise shared pages are not divided between them
+    barrier.wait()
+    results.put((rss_bytes(), pss_bytes(), rss_bytes() - rss_before))
+    barrier.wait()
+    db.close()
+
+
+def bench_workers(args: argparse.Namespace):
+    sample_db = KeyValueDB(db_path=Path(args.db_path), compact_index=True)
+    sample_db.connect()
+    all_keys = list(sample_db.hash)
+    sample_db.close()
+    keys = random.choices(all_keys, k=args.lookups) if all_keys else []
+    del all_keys
+
+    mp = multiprocessing.get_context('spawn')
+    normalized = not args.no_normalized
+    print(f'{args.workers} workers, {args.lookups} lookups per worker, normalized index: {normalized}')
+    print(f'{"index":<8} {"RSS per worker, Mb":>19} {"PSS per worker, Mb":>19} {"index RSS, Mb":>14}')
+    for mode in ('dict', 'compact', 'shared'):
+        barrier = mp.Barrier(args.workers)
+        results = mp.Queue()
+        workers = [
+            mp.Process(target=run_worker, args=(args.db_path, mode, normalized, keys, barrier, results))
+            for _ in range(args.workers)
+        ]
+        for w in workers:
+            w.start()
+        measurements = [results.get() for _ in workers]
+        for w in workers:
+            w.join()
+        rss, pss, index_rss = (sum(m[i] for m in measurements) / len(measurements) / 1024 / 1024 for i in range(3))
+        print(f'{mode:<8} {rss:>19.1f} {pss:>19.1f} {index_rss:>14.1f}')
+
+
+def measure_index(db_path: str, compact_index: bool, lookups: int) -> dict[str, float]:
+    gc.collect()
+    rss_before = rss_bytes()
+    db = KeyValueDB(db_path=Path(db_path), compact_index=compact_index)
+    started_at = time.perf_counter()
+    db.connect()
+    connect_sec = time.perf_counter() - started_at
+    gc.collect()
+    rss_after = rss_bytes()
+
+    keys = random.choices(list(db.hash), k=lookups) if len(db.hash) > 0 else []
+    missing_keys = [k + '\0' for k in keys]
+    started_at = time.perf_counter()
+    for k in keys:
+        db.has(k)
+    hit_sec = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    for k in missing_keys:
+        db.has(k)
+    miss_sec = time.perf_counter() - started_at
+    res = {
+        'keys': len(db.hash),
+        'connect_sec': connect_sec,
+        'index_mb': (rss_after - rss_before) / 1024 / 1024,
+        'hit_us': hit_sec / max(len(keys), 1) * 1e6,
+        'miss_us': miss_sec / max(len(keys), 1) * 1e6,
+    }
+    db.close()
+    return res
+
+
+def bench_index(args: argparse.Namespace):
+    print(f'{"index":<8} {"keys":>10} {"connect, sec":>13} {"RSS, Mb":>9} {"hit, us":>9} {"miss, us":>9}')
+    for name, compact_index in (('dict', False), ('compact', True)):
+        # every index is measured in a fresh process, otherwise freed memory of the previous one distorts RSS
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            res = executor.submit(measure_index, args.db_path, compact_index, args.lookups).result()
+        print(
+            f'{name:<8} {res["keys"]:>10} {res["connect_sec"]:>13.3f} {res["index_mb"]:>9.1f} '
+            f'{res["hit_us"]:>9.2f} {res["miss_us"]:>9.2f}'
+        )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(prog='src.core.database.cli', description='DerTutor corpus db maintenance')
+    commands = parser.add_subparsers(required=True)
+
+    compact_parser = commands.add_parser('compact', help='remove deleted records from KeyValueDB files')
+    compact_parser.add_argument(
+        'db_paths', nargs='+', help='path to a KeyValueDB file or a SegmentedKeyValueDB folder, e.g. data/pron/de_pron.bin'
+    )
+    compact_parser.set_defaults(func=compact)
+
+    segment_parser = commands.add_parser('segment', help='copy a KeyValueDB file into a SegmentedKeyValueDB folder')
+    segment_parser.add_argument('src_path', help='path to a KeyValueDB file, e.g. data/pron/de_pron.bin')
+    segment_parser.add_argument('dst_path', help='path to a SegmentedKeyValueDB folder, e.g. data/pron/de_pron')
+    segment_parser.add_argument('--max-segment-mb', type=int, default=256, help='size limit of a segment file')
+    segment_parser.add_argument('--batch-mb', type=int, default=64, help='size of records written with one fsync')
+    segment_parser.set_defaults(func=segment)
+
+    ingest_parser = commands.add_parser('ingest', help='write all files of a folder or a tarball into a db')
+    ingest_parser.add_argument('db_path', help='path to a KeyValueDB file or a SegmentedKeyValueDB folder')
+    ingest_parser.add_argument('src_path', help='folder or tar/tar.gz file, the name of a file without suffix is the key')
+    ingest_parser.add_argument('--suffix', default='.mp3', help='only files with the suffix are ingested')
+    ingest_parser.add_argument('--workers', type=int, default=8, help='number of threads reading files of a folder')
+    ingest_parser.add_argument('--batch-mb', type=int, default=64, help='size of records written with one fsync')
+    ingest_parser.set_defaults(func=ingest)
+
+    bench_parser = commands.add_parser('bench-index', help='compare RSS and lookup latency of dict and compact index')
+    bench_parser.add_argument('db_path', help='path to a KeyValueDB file')
+    bench_parser.add_argument('--lookups', type=int, default=100_000, help='number of has() calls to measure')
+    bench_parser.set_defaults(func=bench_index)
+
+    workers_parser = commands.add_parser(
+        'bench-workers', help='compare memory of worker processes using dict, compact and shared index'
+    )
+    workers_parser.add_argument('db_path', help='path to a KeyValueDB file')
+    workers_parser.add_argument('--workers', type=int, default=4, help='number of worker processes')
+    workers_parser.add_argument('--lookups', type=int, default=10_000, help='number of has() calls per worker')
+    workers_parser.add_argument(
+        '--no-normalized',
+        action='store_true',
+        help='without the normalized index (it is on by default, like NORMALIZED_CORPUS_INDEX)',
+    )
+    workers_parser.set_defaults(func=bench_workers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
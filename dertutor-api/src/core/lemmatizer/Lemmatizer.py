@@ -0,0 +1,252 @@
+import asyncio
+import multiprocessing
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+from HanTa import HanoverTagger as ht
+
+
+@dataclass
+class LemmatizerStats:
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+    workers: int
+    pending: int
+    rejected: int
+
+
+class LemmatizerBusyError(Exception):
+    def __init__(self, details: str):
+        super().__init__()
+        self.details = details
+
+    def __str__(self):
+        return f'LemmatizerBusyError: {self.details}'
+
+
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?])\s+')
+# words with inner hyphens and apostrophes (E-Mail, geht's) and single punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+(?:[-'’]\w+)*|[^\w\s]")
+
+# the tagger of a worker process, it is loaded once by init_worker()
+worker_tagger: Any = None
+
+
+def tokenize_sentences(text: str) -> list[list[str]]:
+    """Die Kinder spielen. Wo ist es? -> [['Die', 'Kinder', 'spielen', '.'], ['Wo', 'ist', 'es', '?']]"""
+    sentences = [TOKEN_PATTERN.findall(s) for s in SENTENCE_END_PATTERN.split(text)]
+    return [s for s in sentences if s]
+
+
+def analyze_words(tagger: Any, words: list[str]) -> list[tuple[str, str]]:
+    return [tagger.analyze(w) for w in words]
+
+
+def tag_sentences(tagger: Any, sentences: list[list[str]]) -> list[list[tuple[str, str, str]]]:
+    """Token, lemma and pos of every token, the pos is chosen in the context of the sentence"""
+    return [[tuple(t) for t in tagger.tag_sent(s)] for s in sentences]
+
+
+def init_worker(model: str):
+    global worker_tagger
+    worker_tagger = ht.HanoverTagger(model)
+
+
+def analyze_in_worker(word: str) -> tuple[str, str]:
+    return worker_tagger.analyze(word)
+
+
+def call_in_worker(fn: Callable[[Any, Any], Any], arg: Any) -> Any:
+    return fn(worker_tagger, arg)
+
+
+class Lemmatizer:
+    """Memoizes HanoverTagger.analyze(): surface form -> (lemma, pos).
+
+    Text is dominated by a few thousand common words, so most calls are answered from an LRU cache of
+    max_size words instead of evaluating the morphological model. The analysis of a word does not depend
+    on the context, the cache never has to be invalidated.
+
+    analyze_async() evaluates the model in a pool of workers processes, every process loads the model once,
+    so the analysis does not block the event loop and uses other cores. A call waits at most timeout seconds,
+    at most max_pending words are analyzed at a time, LemmatizerBusyError is raised instead of queueing more.
+    Concurrent calls for the same word share one analysis. With workers=0 the model is evaluated in place.
+
+    analyze_many_async() and tag_sentences_async() send all the work of a request to a worker process as one job,
+    repeated words and sentences are analyzed once.
+
+    analyze() evaluates the model in the calling thread, the model of this process is loaded on first use.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_size: int = 10_000,
+        workers: int = 0,
+        timeout: float = 2.0,
+        max_pending: int = 64,
+    ) -> None:
+        self.model = model
+        self.local_tagger: Any = None
+        self.max_size = max_size
+        self.results: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        # word -> analysis in a worker process, touched only by the event loop
+        self.in_flight: dict[str, asyncio.Future] = {}
+        # batch jobs in worker processes, touched only by the event loop
+        self.pending_jobs = 0
+        self.executor: ProcessPoolExecutor | None = None
+        if workers > 0:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(model,),
+            )
+
+    @property
+    def tagger(self) -> Any:
+        with self.lock:
+            if self.local_tagger is None:
+                self.local_tagger = ht.HanoverTagger(self.model)
+            return self.local_tagger
+
+    def cached(self, word: str) -> tuple[str, str] | None:
+        with self.lock:
+            res = self.results.get(word)
+            if res is not None:
+                self.results.move_to_end(word)
+                self.hits += 1
+                return res
+            self.misses += 1
+            return None
+
+    def remember(self, word: str, res: tuple[str, str]):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.results[word] = res
+            self.results.move_to_end(word)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+                self.evictions += 1
+
+    def analyze(self, word: str) -> tuple[str, str]:
+        res = self.cached(word)
+        if res is not None:
+            return res
+
+        # the model is evaluated without the lock, a word can be analyzed twice by concurrent callers
+        res = self.tagger.analyze(word)
+        self.remember(word, res)
+        return res
+
+    async def analyze_async(self, word: str) -> tuple[str, str]:
+        res = self.cached(word)
+        if res is not None:
+            return res
+        if not self.executor:
+            res = self.tagger.analyze(word)
+            self.remember(word, res)
+            return res
+
+        future = self.in_flight.get(word)
+        if future is None:
+            self.check_pending()
+            future = asyncio.wrap_future(self.executor.submit(analyze_in_worker, word))
+            self.in_flight[word] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(word, None))
+
+        try:
+            # shield: a timed out caller must not cancel the analysis shared with other callers
+            analysis: tuple[str, str] = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except TimeoutError:
+            self.rejected += 1
+            raise LemmatizerBusyError(details=f'Analysis of <{word}> has timed out')
+        self.remember(word, analysis)
+        return analysis
+
+    async def analyze_many_async(self, words: list[str]) -> dict[str, tuple[str, str]]:
+        """Analysis of every distinct word, the words missing in the cache are analyzed by one job"""
+        results: dict[str, tuple[str, str]] = {}
+        misses: list[str] = []
+        for word in dict.fromkeys(words):
+            res = self.cached(word)
+            if res is not None:
+                results[word] = res
+            else:
+                misses.append(word)
+
+        if misses:
+            for word, res in zip(misses, await self.run_job(analyze_words, misses)):
+                self.remember(word, res)
+                results[word] = res
+        return results
+
+    async def tag_sentences_async(self, sentences: list[list[str]]) -> list[list[tuple[str, str, str]]]:
+        """Token, lemma and pos of every token of the sentences, tagged by one job.
+        The result depends on the context, so it is not cached."""
+        distinct = list(dict.fromkeys(tuple(s) for s in sentences))
+        tagged = dict(zip(distinct, await self.run_job(tag_sentences, [list(s) for s in distinct])))
+        return [tagged[tuple(s)] for s in sentences]
+
+    async def run_job(self, fn: Callable[[Any, Any], Any], arg: Any) -> Any:
+        if not self.executor:
+            return fn(self.tagger, arg)
+
+        self.check_pending()
+        self.pending_jobs += 1
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(self.executor.submit(call_in_worker, fn, arg)), self.timeout
+            )
+        except TimeoutError:
+            self.rejected += 1
+            raise LemmatizerBusyError(details='Batch analysis has timed out')
+        finally:
+            self.pending_jobs -= 1
+
+    def pending(self) -> int:
+        return len(self.in_flight) + self.pending_jobs
+
+    def check_pending(self):
+        if self.pending() >= self.max_pending:
+            self.rejected += 1
+            raise LemmatizerBusyError(details=f'{self.pending()} analyses are in progress')
+
+    def stats(self) -> LemmatizerStats:
+        with self.lock:
+            requests = self.hits + self.misses
+            return LemmatizerStats(
+                max_size=self.max_size,
+                size=len(self.results),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=round(self.hits / requests, 4) if requests else 0.0,
+                workers=self.workers,
+                pending=self.pending(),
+                rejected=self.rejected,
+            )
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,2 @@
+__all__ = ('Lemmatizer', 'LemmatizerBusyError', 'LemmatizerStats', 'tokenize_sentences')
+from .Lemmatizer import Lemmatizer, LemmatizerBusyError, LemmatizerStats, tokenize_sentences
@@ -1,4 +1,5 @@
-from sqlalchemy import ForeignKey, Integer, MetaData, String, Text, UniqueConstraint
+from sqlalchemy import Computed, ForeignKey, Index, Integer, MetaData, String, Text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import REGCONFIG, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -68,8 +69,23 @@ class Note(Base):
     audio_url: Mapped[str] = mapped_column(String(255), default='')
     level: Mapped[int | None] = mapped_column(Integer)
     tag_id: Mapped[int | None] = mapped_column(ForeignKey('tags.id'))
+    # text search config of the lang (german, english), set by the trigger notes_set_ts_config
+    ts_config: Mapped[str] = mapped_column(REGCONFIG, server_default='simple', deferred=True)
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed("setweight(to_tsvector(ts_config, name), 'A') || setweight(to_tsvector(ts_config, text), 'B')"),
+        deferred=True,
+    )
     media: Mapped[list['Media']] = relationship(cascade='all, delete')
-    __table_args__ = (UniqueConstraint('voc_id', 'name'),)
+    __table_args__ = (
+        UniqueConstraint('voc_id', 'name'),
+        Index('ix_notes_search_vector', 'search_vector', postgresql_using='gin'),
+        # seek of the cursor pagination over the notes of a voc sorted by id
+        Index('ix_notes_voc_id_id', 'voc_id', 'id'),
+        # trigram indexes of ILIKE '%key%' search, see NotesDAO.search_query
+        Index('ix_notes_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_notes_text_trgm', 'text', postgresql_using='gin', postgresql_ops={'text': 'gin_trgm_ops'}),
+    )
 
 
 class Media(Base):
@@ -12,6 +12,19 @@ class Settings(BaseSettings):
     connect_en_ru_db: bool = False
     connect_en_pron_db: bool = False
     connect_de_pron_db: bool = False
+    mmap_pron_db: bool = False
+    pron_db_read_workers: int = 8
+    segmented_pron_db: bool = False
+    pron_db_max_segment_mb: int = 256
+    normalized_corpus_index: bool = True
+    shared_pron_db_index: bool = False
+    pron_db_cache_mb: int = 0
+    en_ru_text_index: bool = False
+    en_ru_text_index_workers: int = 4
+    de_lemma_cache_size: int = 10_000
+    de_lemma_workers: int = 2
+    de_lemma_timeout_sec: float = 2.0
+    de_lemma_max_pending: int = 64
 
     model_config = SettingsConfigDict(
         env_file='.env',
@@ -0,0 +1,34 @@
+from src.core.database import CompactIndex
+
+
+def test_keys_with_prefix_skips_removed_and_merges_overlay():
+    index = CompactIndex((f'haus{i:03}', (i, i, 1)) for i in range(100))
+    for i in range(0, 50):
+        del index[f'haus{i:03}']
+    index['haus'] = (1000, 1000, 1)
+    index['hausa'] = (1001, 1001, 1)
+    index['hauz'] = (1002, 1002, 1)
+
+    assert index.keys_with_prefix('haus', 3) == ['haus', 'haus050', 'haus051']
+    assert index.keys_with_prefix('hausa', 3) == ['hausa']
+    assert index.keys_with_prefix('haus09', 20) == [f'haus{i:03}' for i in range(90, 100)]
+    assert index.keys_with_prefix('x', 3) == []
+
+
+def test_keys_with_prefix_reads_only_limit_keys_after_removes(monkeypatch):
+    index = CompactIndex((f'key{i:04}', (i, i, 1)) for i in range(2000))
+    # many removes far away from the prefix
+    for i in range(1000, 1900):
+        del index[f'key{i:04}']
+
+    read = []
+    base_key = CompactIndex.base_key
+
+    def counting_base_key(self, i):
+        read.append(i)
+        return base_key(self, i)
+
+    monkeypatch.setattr(CompactIndex, 'base_key', counting_base_key)
+    assert index.keys_with_prefix('key0', 5) == ['key0000', 'key0001', 'key0002', 'key0003', 'key0004']
+    # the binary search and the 5 keys, not the number of removed keys
+    assert len(read) < 30
@@ -0,0 +1,50 @@
+import array
+
+from src.core.database import InvertedIndex
+from src.core.database.InvertedIndex import index_records
+
+
+def item(key: str, description: str) -> dict:
+    return {'key': key, 'description': description, 'examples': []}
+
+
+def found_keys(index: InvertedIndex, query: str) -> set[str]:
+    return {key for key, _ in index.search(query, 10)}
+
+
+def test_edits_replace_and_remove_docs():
+    index = InvertedIndex()
+    index.reserve(['apple', 'house'])
+    index.merge(
+        {
+            'fruit': (array.array('I', [0]), array.array('H', [3])),
+            'building': (array.array('I', [1]), array.array('H', [3])),
+        }
+    )
+
+    index.add('apple', item('apple', 'red fruit'))
+    index.add('apple', item('apple', 'green fruit'))
+    index.add('tree', item('tree', 'plant with fruit'))
+    index.remove('house')
+
+    assert len(index) == 2
+    assert found_keys(index, 'fruit') == {'apple', 'tree'}
+    assert found_keys(index, 'green') == {'apple'}
+    assert found_keys(index, 'red') == set()
+    assert found_keys(index, 'building') == set()
+
+    index.remove('tree')
+    index.add('house', item('house', 'building'))
+    assert found_keys(index, 'fruit') == {'apple'}
+    assert found_keys(index, 'building') == {'house'}
+    assert len(index) == 2
+
+
+def test_index_records(tmp_path):
+    db_path = tmp_path / 'test.db'
+    values = [b'{"key":"a","description":"Haus am See"}', b'{"key":"b","examples":[{"en":"house","ru":"dom"}]}']
+    db_path.write_bytes(b''.join(values))
+    postings = index_records(db_path, 10, [(0, len(values[0])), (len(values[0]), len(values[1]))])
+    assert list(postings['haus'][0]) == [10]
+    assert list(postings['house'][0]) == [11]
+    assert list(postings['see'][1]) == [3]
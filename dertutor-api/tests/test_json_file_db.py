@@ -0,0 +1,105 @@
+import fcntl
+import multiprocessing
+import os
+import threading
+
+import orjson
+from src.core.database import JsonFileDB
+
+ITEMS = [{'key': f'word{i}', 'description': f'description of word{i}'} for i in range(10)]
+
+
+def write_json_file(db_path, items: list[dict]):
+    db_path.write_bytes(orjson.dumps(items))
+
+
+def read_json_file(db_path) -> dict[str, dict]:
+    return {item['key']: item for item in orjson.loads(db_path.read_bytes())}
+
+
+def edit_and_crash(db_path):
+    """Edits the db and exits without folding the journal"""
+    db = JsonFileDB(db_path)
+    db.connect()
+    db.write({'key': 'word1', 'description': 'changed'})
+    db.write({'key': 'new', 'description': 'added'})
+    db.remove('word2')
+    os._exit(1)
+
+
+def expected_after_edit() -> dict[str, dict]:
+    items = {item['key']: item for item in ITEMS}
+    items['word1'] = {'key': 'word1', 'description': 'changed'}
+    items['new'] = {'key': 'new', 'description': 'added'}
+    del items['word2']
+    return items
+
+
+def test_journal_is_replayed_and_folded_after_crash(tmp_path):
+    db_path = tmp_path / 'test.json'
+    write_json_file(db_path, ITEMS)
+
+    process = multiprocessing.get_context('spawn').Process(target=edit_and_crash, args=(db_path,))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+    assert read_json_file(db_path) == {item['key']: item for item in ITEMS}
+    journal_path = tmp_path / 'test.json.journal'
+    # an operation that has not been written completely is dropped
+    with journal_path.open('ab') as f:
+        f.write(b'{"op":"remove","key":"wo')
+
+    db = JsonFileDB(db_path)
+    db.connect()
+    try:
+        expected = expected_after_edit()
+        assert read_json_file(db_path) == expected
+        assert journal_path.stat().st_size == 0
+        for key, item in expected.items():
+            assert db.read(key) == item
+        assert db.read('word2') is None
+    finally:
+        db.close()
+
+
+def test_fold_includes_operations_of_other_connections(tmp_path):
+    db_path = tmp_path / 'test.json'
+    write_json_file(db_path, ITEMS)
+    db1 = JsonFileDB(db_path)
+    db2 = JsonFileDB(db_path)
+    db1.connect()
+    db2.connect()
+
+    db1.write({'key': 'word1', 'description': 'changed'})
+    db2.write({'key': 'new', 'description': 'added'})
+    db2.remove('word2')
+    # db1 folds the operations of db2 too, db2 finds its json-file folded by another connection and rebuilds
+    db1.close()
+    db2.write({'key': 'last', 'description': 'after the fold'})
+    db2.close()
+
+    expected = expected_after_edit()
+    expected['last'] = {'key': 'last', 'description': 'after the fold'}
+    assert read_json_file(db_path) == expected
+    assert (tmp_path / 'test.json.journal').stat().st_size == 0
+
+
+def test_fold_waits_for_kv_lock(tmp_path):
+    db_path = tmp_path / 'test.json'
+    write_json_file(db_path, ITEMS)
+    db = JsonFileDB(db_path)
+    db.connect()
+    db.write({'key': 'new', 'description': 'added'})
+
+    with (tmp_path / 'test.json.kvdb.lock').open('a') as lock_file:
+        # another process is building, replaying or folding
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        folding = threading.Thread(target=db.store)
+        folding.start()
+        folding.join(timeout=0.5)
+        assert folding.is_alive()
+        assert 'new' not in read_json_file(db_path)
+    folding.join()
+
+    assert read_json_file(db_path)['new'] == {'key': 'new', 'description': 'added'}
+    db.close()
@@ -0,0 +1,262 @@
+import os
+import threading
+
+import pytest
+from src.core.database import CompactIndex, KeyValueDB
+
+INDEX_KINDS = {
+    'dict': {},
+    'compact': {'compact_index': True},
+    'shared': {'shared_index': True, 'normalized_index': True},
+}
+
+
+def value_of(key: str, version: int = 0) -> bytes:
+    return f'{key}:{version}:'.encode() * 8
+
+
+def connect(db_path, kind: str) -> KeyValueDB:
+    db = KeyValueDB(db_path, read_workers=1, **INDEX_KINDS[kind])
+    db.connect()
+    return db
+
+
+def assert_content(db: KeyValueDB, expected: dict[str, bytes]):
+    assert len(db.hash) == len(expected)
+    for key, bb in expected.items():
+        assert db.read(key) == bb, key
+
+
+@pytest.fixture(params=list(INDEX_KINDS))
+def kind(request) -> str:
+    return request.param
+
+
+def test_compaction_keeps_changes_made_while_copying(tmp_path, kind, monkeypatch):
+    db_path = tmp_path / 'test.db'
+    db = connect(db_path, kind)
+    expected = {f'key{i:05}': value_of(f'key{i:05}') for i in range(2000)}
+    db.write_many(expected.items())
+    for i in range(0, 100, 2):
+        db.remove(f'key{i:05}')
+        expected.pop(f'key{i:05}')
+    etag_before = db.etag('key00001')
+
+    calls = 0
+    copy_records = KeyValueDB.copy_records
+
+    def change_db(first: int, count: int):
+        for i in range(first, first + count):
+            key = f'key{i:05}'
+            if i % 3 == 0:
+                db.remove(key)
+                expected.pop(key, None)
+            else:
+                # replaced value, or a new key beyond the copied ones
+                db.remove(key)
+                expected[key] = value_of(key, version=1)
+                db.write(key, expected[key])
+
+    def copy_records_and_change(src, dst, records, new_hash):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            # more changes than COMPACTION_SWAP_CHANGES: they are copied by the loop without the lock
+            change_db(100, 600)
+        elif calls == 2:
+            # these are left for the swap under the lock
+            change_db(1900, 200)
+        copy_records(src, dst, records, new_hash)
+
+    monkeypatch.setattr(KeyValueDB, 'copy_records', staticmethod(copy_records_and_change))
+    report = db.compact()
+    monkeypatch.undo()
+
+    assert calls > 2
+    assert report.keys == len(expected)
+    assert report.reclaimed_bytes > 0
+    assert_content(db, expected)
+    assert db.etag('key00001') != etag_before
+    db.close()
+
+    # the swapped index-file and the entries appended after the swap describe the compacted db-file
+    db = connect(db_path, kind)
+    assert_content(db, expected)
+    db.close()
+
+
+def test_compaction_with_concurrent_writes_and_removes(tmp_path, kind):
+    db_path = tmp_path / 'test.db'
+    db = connect(db_path, kind)
+    expected = {f'key{i:05}': value_of(f'key{i:05}') for i in range(20000)}
+    db.write_many(expected.items())
+    for i in range(0, 20000, 2):
+        db.remove(f'key{i:05}')
+        expected.pop(f'key{i:05}')
+    etag_before = db.etag('key00001')
+
+    compacted = threading.Event()
+
+    def write_and_remove():
+        i = 0
+        while not compacted.is_set() or i < 1000:
+            key = f'key{i % 20000:05}'
+            version = i // 20000 + 1
+            db.remove(key)
+            if i % 5 == 0:
+                expected.pop(key, None)
+            else:
+                expected[key] = value_of(key, version)
+                db.write(key, expected[key])
+            i += 1
+
+    writer = threading.Thread(target=write_and_remove)
+    writer.start()
+    try:
+        db.compact()
+    finally:
+        compacted.set()
+        writer.join()
+
+    assert_content(db, expected)
+    # the key may have been rewritten meanwhile, but the db-file part of the etag changes anyway
+    key = next(iter(expected))
+    assert db.etag(key).split('-')[0] != etag_before.split('-')[0]
+    db.close()
+
+    db = connect(db_path, kind)
+    assert_content(db, expected)
+    db.close()
+
+
+def write_db(db_path, kind: str, keys: list[str]) -> dict[str, bytes]:
+    db = connect(db_path, kind)
+    expected = {key: value_of(key) for key in keys}
+    db.write_many(expected.items())
+    db.close()
+    # the shared index is stored on connect, the keys written after it are in the index-file only
+    connect(db_path, kind).close()
+    return expected
+
+
+def count_scans(monkeypatch) -> list[int]:
+    scans = [0]
+    scan = KeyValueDB.scan
+
+    def counting_scan(self):
+        scans[0] += 1
+        scan(self)
+
+    monkeypatch.setattr(KeyValueDB, 'scan', counting_scan)
+    return scans
+
+
+def shared_index_is_valid(db_path, normalized: bool = False) -> bool:
+    stat = db_path.stat()
+    index = CompactIndex.load_mapped(
+        db_path.with_name(db_path.name + '.cidx'), stat.st_size, stat.st_mtime_ns, normalized=normalized
+    )
+    return index is not None
+
+
+def test_index_is_loaded_without_scan(tmp_path, kind, monkeypatch):
+    db_path = tmp_path / 'test.db'
+    expected = write_db(db_path, kind, [f'key{i}' for i in range(100)])
+    scans = count_scans(monkeypatch)
+
+    db = connect(db_path, kind)
+    assert_content(db, expected)
+    assert scans[0] == 0
+    db.close()
+
+
+def test_stale_index_is_rebuilt(tmp_path, kind, monkeypatch):
+    db_path = tmp_path / 'test.db'
+    expected = write_db(db_path, kind, [f'key{i}' for i in range(100)])
+    # the db-file is changed behind the index: a record is appended by another version of the db
+    other_path = tmp_path / 'other.db'
+    appended = write_db(other_path, 'dict', ['appended'])
+    with db_path.open('ab') as f:
+        f.write(other_path.read_bytes())
+    expected.update(appended)
+    scans = count_scans(monkeypatch)
+
+    db = connect(db_path, kind)
+    assert_content(db, expected)
+    assert scans[0] == 1
+    db.close()
+
+    if kind == 'shared':
+        assert shared_index_is_valid(db_path, normalized=True)
+    db = connect(db_path, kind)
+    assert_content(db, expected)
+    assert scans[0] == 1
+    db.close()
+
+
+def test_corrupted_index_is_rebuilt(tmp_path, kind, monkeypatch):
+    db_path = tmp_path / 'test.db'
+    expected = write_db(db_path, kind, [f'key{i}' for i in range(100)])
+    index_path = tmp_path / 'test.db.idx'
+    index_stat = index_path.stat()
+    # the header is valid, the entries are cut in the middle of a key
+    with index_path.open('r+b') as f:
+        f.truncate(index_stat.st_size - 3)
+    (tmp_path / 'test.db.cidx').unlink(missing_ok=True)
+    scans = count_scans(monkeypatch)
+
+    db = connect(db_path, kind)
+    assert_content(db, expected)
+    assert scans[0] == 1
+    db.close()
+
+
+def test_shared_index_of_another_db_is_rejected(tmp_path, monkeypatch):
+    db_path = tmp_path / 'test.db'
+    expected = write_db(db_path, 'shared', [f'key{i}' for i in range(100)])
+    other_path = tmp_path / 'other.db'
+    write_db(other_path, 'shared', [f'other{i}' for i in range(100)])
+    os.replace(tmp_path / 'other.db.cidx', tmp_path / 'test.db.cidx')
+    assert not shared_index_is_valid(db_path, normalized=True)
+
+    # the index-file is still valid, the shared index is rebuilt from it
+    scans = count_scans(monkeypatch)
+    db = connect(db_path, 'shared')
+    assert_content(db, expected)
+    assert db.read('other1') is None
+    assert scans[0] == 0
+    db.close()
+    assert shared_index_is_valid(db_path, normalized=True)
+
+
+def test_shared_index_without_normalized_keys_is_rejected(tmp_path):
+    db_path = tmp_path / 'test.db'
+    db = KeyValueDB(db_path, read_workers=1, shared_index=True)
+    db.connect()
+    db.write_many([('Straße', b'street'), ('Haus', b'house')])
+    db.close()
+    db = KeyValueDB(db_path, read_workers=1, shared_index=True)
+    db.connect()
+    db.close()
+    assert shared_index_is_valid(db_path)
+    assert not shared_index_is_valid(db_path, normalized=True)
+
+    db = connect(db_path, 'shared')
+    assert db.find('STRASSE') == 'Straße'
+    assert db.find('haus') == 'Haus'
+    db.close()
+    assert shared_index_is_valid(db_path, normalized=True)
+
+
+def test_truncated_shared_index_is_rejected(tmp_path):
+    db_path = tmp_path / 'test.db'
+    expected = write_db(db_path, 'shared', [f'key{i}' for i in range(100)])
+    shared_index_path = tmp_path / 'test.db.cidx'
+    with shared_index_path.open('r+b') as f:
+        f.truncate(shared_index_path.stat().st_size - 1)
+    assert not shared_index_is_valid(db_path, normalized=True)
+
+    db = connect(db_path, 'shared')
+    assert_content(db, expected)
+    db.close()
+    assert shared_index_is_valid(db_path, normalized=True)
@@ -0,0 +1,31 @@
+from src.core.database.InvertedIndex import tokenize
+from src.core.database.NormalizedIndex import NormalizedIndex, normalize_key
+
+
+def test_normalize_key_folds_latin_letters():
+    assert normalize_key('Straße') == 'strasse'
+    assert normalize_key('Häuser') == 'haeuser'
+    assert normalize_key(' Café ') == 'cafe'
+    assert normalize_key('naïve') == 'naive'
+
+
+def test_normalize_key_keeps_cyrillic_letters():
+    # й and ё are letters of their own, not и and е with an accent
+    assert normalize_key('Йод') == 'йод'
+    assert normalize_key('Ёлка') == 'ёлка'
+    assert normalize_key('все') != normalize_key('всё')
+    assert normalize_key('мои') != normalize_key('мой')
+
+
+def test_find_by_normalized_key():
+    index = NormalizedIndex(['Straße', 'всё', 'Café'])
+    assert index.find('STRASSE') == 'Straße'
+    assert index.find('cafe') == 'Café'
+    assert index.find('ВСЁ') == 'всё'
+    assert index.find('все') is None
+
+
+def test_tokenize_folds_like_normalize_key():
+    text = 'Ёлка и йогурт, Café crème, Häuser'
+    assert tokenize(text) == ['ёлка', 'йогурт', 'cafe', 'creme', 'haeuser']
+    assert all(token == normalize_key(token) for token in tokenize(text))
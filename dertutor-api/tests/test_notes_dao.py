@@ -0,0 +1,195 @@
+import asyncio
+import base64
+import random
+import sqlite3
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from src.api.notes.dao import (
+    NotesDAO,
+    SearchParams,
+    decode_cursor,
+    encode_cursor,
+    order_by,
+    parse_sort,
+    seek_predicate,
+)
+
+
+def assert_bad_request(call):
+    with pytest.raises(HTTPException) as e:
+        call()
+    assert e.value.status_code == 400
+
+
+def test_parse_sort():
+    assert parse_sort(None) == [('id', 'desc', None, int)]
+    # vocs.sort_notes is stored with a space
+    assert parse_sort('name asc') == [('name', 'asc', None, str)]
+    assert parse_sort('name:desc') == [('name', 'desc', None, str)]
+    assert parse_sort('Text') == [('text', 'asc', None, str)]
+    assert parse_sort('level:asc, name:asc') == [('level', 'asc', 'last', int), ('name', 'asc', None, str)]
+    assert parse_sort('tag_id desc') == [('tag_id', 'desc', 'first', int)]
+    assert parse_sort('level asc nulls first') == [('level', 'asc', 'first', int)]
+    # NULLS of a column that is never NULL change nothing
+    assert parse_sort('id desc nulls last') == [('id', 'desc', None, int)]
+
+
+@pytest.mark.parametrize(
+    'sort', ['unknown', 'name up', 'name asc,', 'name; DROP TABLE notes', 'level asc nulls', 'name asc nulls middle']
+)
+def test_parse_sort_rejects(sort):
+    assert_bad_request(lambda: parse_sort(sort))
+
+
+def test_order_by():
+    assert order_by(('name', 'asc', None, str)) == 'name asc'
+    assert order_by(('level', 'desc', 'first', int)) == 'level desc NULLS first'
+
+
+def test_seek_predicate_of_one_direction_is_row_comparison():
+    terms = [('voc_id', 'asc', None, int), ('id', 'asc', None, int)]
+    assert seek_predicate(terms, [1, 10]) == '(voc_id, id) > (:c0, :c1)'
+    terms = [('name', 'desc', None, str), ('id', 'desc', None, int)]
+    assert seek_predicate(terms, ['a', 10]) == '(name, id) < (:c0, :c1)'
+
+
+def test_seek_predicate_of_mixed_directions_is_bounded_by_first_term():
+    terms = [('name', 'asc', None, str), ('id', 'desc', None, int)]
+    assert seek_predicate(terms, ['a', 10]) == 'name >= :c0 AND ((name > :c0) OR (name = :c0 AND id < :c1))'
+
+
+def test_seek_predicate_of_nullable_term():
+    terms = [('level', 'asc', 'last', int), ('id', 'desc', None, int)]
+    assert seek_predicate(terms, [2, 10]) == '(((level > :c0 OR level IS NULL)) OR (level = :c0 AND id < :c1))'
+    # nothing is after NULL in ascending order but the other NULLs
+    assert seek_predicate(terms, [None, 10]) == '((FALSE) OR (level IS NULL AND id < :c1))'
+
+    terms = [('level', 'desc', 'first', int), ('id', 'desc', None, int)]
+    assert seek_predicate(terms, [2, 10]) == '((level < :c0) OR (level = :c0 AND id < :c1))'
+    assert seek_predicate(terms, [None, 10]) == '((level IS NOT NULL) OR (level IS NULL AND id < :c1))'
+
+
+def test_search_query_binds_cursor_values():
+    params = SearchParams(lang_id=1, voc_id=2, sort='level:asc', pagination='cursor', size=10)
+    order_terms = NotesDAO.order_terms(params)
+    assert order_terms == [('level', 'asc', 'last', int), ('id', 'desc', None, int)]
+
+    query = NotesDAO.search_query(params=params, count=False, order_terms=order_terms, cursor_values=[3, 42])
+    compiled = query.compile()
+    assert '(level > :c0 OR level IS NULL)' in compiled.string
+    assert 'ORDER BY level asc NULLS last, id desc' in compiled.string
+    assert 'OFFSET' not in compiled.string
+    assert {k: compiled.params[k] for k in ('lang_id', 'voc_id', 'c0', 'c1', 'limit')} == {
+        'lang_id': 1,
+        'voc_id': 2,
+        'c0': 3,
+        'c1': 42,
+        'limit': 10,
+    }
+
+    # a NULL of the cursor is compared by IS NULL and has no parameter
+    query = NotesDAO.search_query(params=params, count=False, order_terms=order_terms, cursor_values=[None, 42])
+    compiled = query.compile()
+    assert 'level IS NULL AND id < :c1' in compiled.string
+    assert 'c0' not in compiled.params
+
+
+def test_offset_query_keeps_nulls_of_sort():
+    params = SearchParams(lang_id=1, sort='tag_id desc', page=3, size=10)
+    compiled = NotesDAO.search_query(params=params, count=False).compile()
+    assert 'ORDER BY voc_id asc, tag_id desc NULLS first, id desc' in compiled.string
+    assert 'COALESCE' not in compiled.string
+    assert compiled.params['offset'] == 20
+
+
+def test_cursor_round_trip():
+    terms = [('level', 'asc', 'last', int), ('name', 'asc', None, str), ('id', 'desc', None, int)]
+    cursor = encode_cursor('sort', [None, 'Haus', 42])
+    assert decode_cursor(cursor, 'sort', terms) == [None, 'Haus', 42]
+    rank_terms = [('ts_rank(...)', 'desc', None, float), ('id', 'desc', None, int)]
+    assert decode_cursor(encode_cursor('sort', [0, 7]), 'sort', rank_terms) == [0, 7]
+    assert decode_cursor(encode_cursor('sort', [0.25, 7]), 'sort', rank_terms) == [0.25, 7]
+
+
+@pytest.mark.parametrize(
+    'cursor',
+    [
+        encode_cursor('other sort', [1, 'Haus', 42]),
+        encode_cursor('sort', [1, 'Haus']),
+        # a str where an int is expected would fail in the database
+        encode_cursor('sort', ['1', 'Haus', 42]),
+        encode_cursor('sort', [1, 'Haus', '42']),
+        encode_cursor('sort', [1, 5, 42]),
+        encode_cursor('sort', [1, 'Haus', True]),
+        encode_cursor('sort', [1, 'Haus', 4.2]),
+        # only a nullable column may be NULL
+        encode_cursor('sort', [1, None, 42]),
+        base64.urlsafe_b64encode(orjson.dumps({'sort': 'sort', 'values': {'a': 1}})).decode(),
+        base64.urlsafe_b64encode(b'not json').decode(),
+        'not base64!',
+    ],
+)
+def test_decode_cursor_rejects(cursor):
+    terms = [('level', 'asc', 'last', int), ('name', 'asc', None, str), ('id', 'desc', None, int)]
+    assert_bad_request(lambda: decode_cursor(cursor, 'sort', terms))
+
+
+def test_search_notes_rejects_tampered_cursor():
+    params = SearchParams(lang_id=1, voc_id=2, sort='level:asc', pagination='cursor')
+    sort_id = NotesDAO.sort_id(params)
+    params.cursor = encode_cursor(sort_id, ['3', 42])
+    # the cursor is rejected before the database is queried
+    assert_bad_request(lambda: asyncio.run(NotesDAO.search_notes(None, params)))  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize(
+    'sort', ['level:asc', 'level:desc', 'tag_id asc nulls first', 'level desc nulls last, tag_id:asc', 'name asc']
+)
+def test_seek_pages_follow_order_by(sort):
+    """Pages after cursors are the same as one ORDER BY, including the NULLs of nullable columns"""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, name TEXT, voc_id INT, level INT, tag_id INT)')
+    rnd = random.Random(1)
+    db.executemany(
+        'INSERT INTO notes VALUES (?, ?, ?, ?, ?)',
+        [
+            (i, rnd.choice('abcd'), rnd.randint(1, 3), rnd.choice([None, 1, 2, 3]), rnd.choice([None, 1, 2]))
+            for i in range(1, 400)
+        ],
+    )
+    params = SearchParams(lang_id=1, sort=sort, pagination='cursor')
+    terms = NotesDAO.order_terms(params)
+    columns = ', '.join(expr for expr, _, _, _ in terms)
+    sql_order_by = ', '.join(order_by(term) for term in terms)
+    expected = [row[-1] for row in db.execute(f'SELECT {columns}, id FROM notes ORDER BY {sql_order_by}')]
+
+    ids: list[int] = []
+    cursor_values = None
+    while True:
+        seek = f'WHERE {seek_predicate(terms, cursor_values)}' if cursor_values else ''
+        pp = {f'c{i}': v for i, v in enumerate(cursor_values or []) if v is not None}
+        rows = db.execute(f'SELECT {columns}, id FROM notes {seek} ORDER BY {sql_order_by} LIMIT 7', pp).fetchall()
+        ids += [row[-1] for row in rows]
+        if len(rows) < 7:
+            break
+        cursor_values = list(rows[-1][:-1])
+    assert ids == expected
+
+
+@pytest.mark.parametrize('changed', [{'lang_id': 2}, {'level': 3}, {'tag_id': 4}, {'voc_id': 5}, {'key': 'other'}])
+def test_cursor_of_other_filters_is_rejected(changed):
+    params = SearchParams(lang_id=1, voc_id=2, key='haus', sort='name:asc', pagination='cursor')
+    cursor = encode_cursor(NotesDAO.sort_id(params), [0, 'Haus', 42])
+    other_params = params.model_copy(update={**changed, 'cursor': cursor})
+    assert NotesDAO.sort_id(other_params) != NotesDAO.sort_id(params)
+    assert_bad_request(lambda: asyncio.run(NotesDAO.search_notes(None, other_params)))  # type: ignore[arg-type]
+
+
+def test_sort_by_text_is_not_supported_by_cursor():
+    params = SearchParams(lang_id=1, sort='text:asc', pagination='cursor')
+    assert_bad_request(lambda: asyncio.run(NotesDAO.search_notes(None, params)))  # type: ignore[arg-type]
+    # offset pagination does not put the text into a cursor
+    params = SearchParams(lang_id=1, sort='text:asc')
+    assert 'ORDER BY voc_id asc, text asc, id desc' in NotesDAO.search_query(params=params, count=False).text
@@ -0,0 +1,18 @@
+import asyncio
+
+from src.core.database import SegmentedKeyValueDB, ValueCache
+
+
+def test_cached_value_is_read_without_executor(tmp_path, monkeypatch):
+    db = SegmentedKeyValueDB(tmp_path / 'db', read_workers=1, cache=ValueCache(max_size=1024 * 1024))
+    db.connect()
+    db.write('haus', b'house')
+    # the first read puts the value into the cache
+    assert asyncio.run(db.read_async('haus')) == b'house'
+
+    def read_in_executor(key: str):
+        raise AssertionError(f'{key} is read in the executor')
+
+    monkeypatch.setattr(db, 'read_resident', read_in_executor)
+    assert asyncio.run(db.read_async('haus')) == b'house'
+    db.close()